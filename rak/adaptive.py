@@ -0,0 +1,97 @@
+class AdaptiveProcessor(object):
+    """Processes lines with demand driven pattern execution and condition
+    processing, and adapts the evaluation order to the observed workload.  The
+    patterns are executed only when a processed condition reads them, their
+    execution times and match rates are collected together with the results of
+    the conditions, and the children of the AND and OR relations are reordered
+    after every reorder_interval lines, so the cheap and decisive checks run
+    first.  The order never changes the results of the root conditions.
+
+    The statistics are dropped when the patterns or the conditions are modified
+    through their handlers.
+
+        pattern_handler: PatternHandler object
+        condition_handler: ConditionHandler object
+        root_ids: ids of the conditions whose results are needed
+        reorder_interval: number of lines between the reorders
+        hysteresis: minimal relative gain of a reorder, see
+                    ConditionHandler.reorder_operands()
+    """
+    def __init__(self, pattern_handler, condition_handler, root_ids,
+                 reorder_interval=1000, hysteresis=0.1):
+        self.pattern_handler = pattern_handler
+        self.condition_handler = condition_handler
+        self.root_ids = list(root_ids)
+        self.reorder_interval = reorder_interval
+        self.hysteresis = hysteresis
+        self.pattern_statistics = {}
+        self.condition_statistics = {}
+        self.processed = 0
+        self.swaps = 0
+        self._revisions = self._get_revisions()
+
+    def _get_revisions(self):
+        return self.pattern_handler.revision, self.condition_handler.revision
+
+    def process(self, line):
+        """Returns the results of the root conditions and of the other conditions
+        processed for them, like ConditionHandler.process_lazy()."""
+        revisions = self._get_revisions()
+        if revisions != self._revisions:
+            self._revisions = revisions
+            self.reset()
+
+        data = self.pattern_handler.execute_lazy(line, self.pattern_statistics)
+        ret = self.condition_handler.process_lazy(data, self.root_ids, self.condition_statistics)
+        self.processed += 1
+        if self.reorder_interval > 0 and self.processed % self.reorder_interval == 0:
+            self.reorder()
+        return ret
+
+    def reorder(self):
+        """Reorders the relation children with the statistics collected so far."""
+        self.swaps += self.condition_handler.reorder_operands(
+            self.get_pattern_costs(), self.condition_statistics, self.hysteresis)
+
+    def reset(self):
+        self.pattern_statistics.clear()
+        self.condition_statistics.clear()
+        self.processed = 0
+
+    def get_pattern_costs(self):
+        """Returns the average execution time of the executed patterns in seconds
+        keyed with their main ids."""
+        ret = {}
+        for main_id, counters in self.pattern_statistics.items():
+            ret[main_id] = counters[2] / counters[0]
+        return ret
+
+    def info(self):
+        """Returns the collected pattern statistics.
+
+        returned_dictionary = {
+            'processed': <number of the processed lines since the last reset>,
+            'swaps': <number of the relation reorders>,
+            'patterns': {
+                <main id>: {
+                    'executions': <number of the executions>,
+                    'hit_rate': <matches per executions>,
+                    'average_time': <average execution time in seconds>
+                },
+                ...
+            }
+        }
+        """
+        patterns = {}
+        for main_id, counters in self.pattern_statistics.items():
+            executions, hits, elapsed = counters
+            patterns[main_id] = {
+                'executions': executions,
+                'hit_rate': float(hits) / executions,
+                'average_time': elapsed / executions
+            }
+        return {
+            'processed': self.processed,
+            'swaps': self.swaps,
+            'patterns': patterns
+        }
@@ -0,0 +1,139 @@
+import sys
+from collections import OrderedDict
+
+# Lines longer than this are processed without caching by default.  Long lines
+# rarely repeat, and they would take most of the memory of the cache.
+DEFAULT_MAX_LINE_LENGTH = 1024
+
+
+def _get_size(obj):
+    """Returns the approximate memory usage of the given result structure in bytes,
+    the shared objects are counted at every reference."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _get_size(key) + _get_size(value)
+    elif isinstance(obj, (tuple, list)):
+        for value in obj:
+            size += _get_size(value)
+    return size
+
+
+class LineResultCache(object):
+    """Least recently used cache of the results of whole lines in front of the
+    pattern execution and the condition processing.  Repeated lines, like health
+    checks or identical stack frames, are processed only once.
+
+    The cache is keyed with the content of the line.  It is cleared automatically
+    when the revision of the pattern handler or the condition handler changes,
+    that is after any pattern or condition modification made through the handlers.
+    Lines longer than max_line_length are processed without caching.  A zero
+    max_size disables the caching.
+
+    The returned results are shared between the lookups of the same line, they
+    must not be modified.
+
+        pattern_handler: PatternHandler object, its execute() result is cached
+        condition_handler: ConditionHandler object, its process() result is cached
+        max_size: maximum number of the cached lines
+        max_line_length: longest line that is cached
+    """
+    def __init__(self, pattern_handler, condition_handler, max_size=4096,
+                 max_line_length=DEFAULT_MAX_LINE_LENGTH):
+        self.pattern_handler = pattern_handler
+        self.condition_handler = condition_handler
+        self.max_size = max_size
+        self.max_line_length = max_line_length
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.invalidations = 0
+        self.memory = 0
+        self._revisions = self._get_revisions()
+
+    def _get_revisions(self):
+        return self.pattern_handler.revision, self.condition_handler.revision
+
+    def process(self, line):
+        """Returns the pattern results and the condition results of the given line,
+        from the cache if the line was processed since the last modification.
+
+        returned_tuple = (
+            <result of PatternHandler.execute()>,
+            <result of ConditionHandler.process()>
+        )
+        """
+        revisions = self._get_revisions()
+        if revisions != self._revisions:
+            self._revisions = revisions
+            if self.entries:
+                self.invalidations += 1
+            self._clear_entries()
+
+        if len(line) > self.max_line_length:
+            self.skipped += 1
+            return self._process(line)
+
+        entry = self.entries.pop(line, None)
+        if entry is not None:
+            self.hits += 1
+            self.entries[line] = entry
+            return entry[0]
+
+        self.misses += 1
+        results = self._process(line)
+        if self.max_size > 0:
+            size = _get_size(line) + _get_size(results)
+            self.entries[line] = (results, size)
+            self.memory += size
+            while len(self.entries) > self.max_size:
+                self.memory -= self.entries.popitem(last=False)[1][1]
+        return results
+
+    def _process(self, line):
+        pattern_results = self.pattern_handler.execute(line)
+        return pattern_results, self.condition_handler.process(pattern_results)
+
+    def resize(self, max_size):
+        self.max_size = max_size
+        while len(self.entries) > max(max_size, 0):
+            self.memory -= self.entries.popitem(last=False)[1][1]
+
+    def _clear_entries(self):
+        self.entries.clear()
+        self.memory = 0
+
+    def clear(self):
+        self._clear_entries()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.invalidations = 0
+
+    def info(self):
+        """Returns the statistics of the cache.  The memory is the approximate size
+        of the cached lines and results in bytes.
+
+        returned_dictionary = {
+            'size': <number of the cached lines>,
+            'max_size': <maximum number of the cached lines>,
+            'hits': <number of the lines returned from the cache>,
+            'misses': <number of the processed lines that could be cached>,
+            'skipped': <number of the lines too long to be cached>,
+            'invalidations': <number of the clears caused by modifications>,
+            'hit_rate': <hits per cacheable lookups>,
+            'memory': <approximate memory usage in bytes>
+        }
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'skipped': self.skipped,
+            'invalidations': self.invalidations,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'memory': self.memory
+        }
@@ -1,4 +1,12 @@
+from __future__ import print_function
+import operator
 import re
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class NoConditionError(Exception):
@@ -6,13 +14,87 @@ class NoConditionError(Exception):
 
 
 class ConditionLoopError(Exception):
-    pass
+    """Raised when a link would close a loop in the condition graph.  The path
+    attribute holds the condition ids of the loop in parent to child order, the
+    first and last ids are the same."""
+    def __init__(self, message='', path=None):
+        super(ConditionLoopError, self).__init__(message)
+        self.path = path
 
 
 class NoActionError(Exception):
     pass
 
 
+_TRUE_PATTERN = re.compile('^(true|True)$')
+_FALSE_PATTERN = re.compile('^(false|False)$')
+_RELATION_UPDATE_PATTERN = re.compile('\\s*relation\\s+"?([=<>!]+)"?\\s*')
+_VALUE_UPDATE_PATTERN = re.compile('\\s*value\\s+("([^"]+)"|\'([^\']+)\')\\s*')
+
+_COMPARISON_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+
+def _get_batch_column(data, pattern_id, length):
+    """Returns the column of the given pattern from the columnar pattern results
+    as a numpy object array and the boolean array of the lines where the pattern
+    matched.  A missing column means the pattern matched in none of the lines."""
+    if numpy is None:
+        raise ImportError('numpy is required for batch processing')
+    column = data.get(pattern_id)
+    if column is None:
+        return None, numpy.zeros(length, dtype=bool)
+    column = numpy.asarray(column, dtype=object)
+    if len(column) != length:
+        raise ValueError('Invalid column length for pattern {}: {}'.format(pattern_id, len(column)))
+    return column, numpy.not_equal(column, None)
+
+
+def collect_hits(results):
+    """Collects the per line pattern results of a block of lines into sparse
+    columns for the bitset processing.
+
+    returned_dictionary = {
+        <pattern id>: {<line index in the block>: <matched content>, ...},
+        ...
+    }
+    """
+    hits = {}
+    for index, data in enumerate(results):
+        for pattern_id, result in data.items():
+            hits.setdefault(pattern_id, {})[index] = result['match']
+    return hits
+
+
+def iter_set_bits(mask):
+    """Yields the line indexes set in the given bitmask in increasing order.  Only
+    the set bits are visited, so sparse masks are cheap to walk."""
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+def unpack_bits(mask, length):
+    """Converts the given bitmask back to a list of per line booleans."""
+    ret = [False] * length
+    for index in iter_set_bits(mask):
+        ret[index] = True
+    return ret
+
+
+def _get_hit_mask(indexes):
+    mask = 0
+    for index in indexes:
+        mask |= 1 << index
+    return mask
+
 
 class Condition(object):
     """Object to represent a condition. Conditions can be interconnected and can
@@ -26,6 +108,9 @@ class Condition(object):
     Loop protocol
         A protocol that finds loops in the newly created realation. If a loop is
         detected an exception will be raised.
+
+    A condition has two child slots by default, adding a child right after the
+    last slot appends a new one.
     """
     def __init__(self, new_id):
         self.is_termination = True
@@ -36,12 +121,22 @@ class Condition(object):
         self.children = [None, None]
 
     def add_child(self, index, new_child):
+        if index == len(self.children):
+            self.children.append(None)
         child = self.children[index]
         if child:
             child.remove_related(self)
         self.children[index] = new_child
         new_child.add_related(self)
 
+    def set_children(self, new_children):
+        for child in self.children:
+            if child:
+                child.remove_related(self)
+        self.children = list(new_children)
+        for child in self.children:
+            child.add_related(self)
+
     def add_related(self, reference):
         self.related_conditions.append(reference)
 
@@ -58,14 +153,18 @@ class Condition(object):
             related._arbitration_protocol()
 
     def _loop_protocol(self, starting_condition):
-        if self.is_termination or 0 == len(self.related_conditions):
+        if self.is_termination:
             return False
-        else:
-            for rel in self.related_conditions:
+        visited = set([self])
+        stack = [self]
+        while stack:
+            for rel in stack.pop().related_conditions:
                 if starting_condition == rel:
                     return True
-                else:
-                    return rel._loop_protocol(starting_condition)
+                if rel not in visited:
+                    visited.add(rel)
+                    stack.append(rel)
+        return False
 
     def process(self, data):
         c1 = None
@@ -74,11 +173,27 @@ class Condition(object):
         c2 = None
         if self.children[1]:
             c2 = self.children[1].id
-        result = self.condition_processor.process(c1, c1, data)
+        if len(self.children) > 2:
+            more = tuple(child.id for child in self.children[2:])
+            result = self.condition_processor.process(c1, c2, data, more)
+        else:
+            result = self.condition_processor.process(c1, c2, data)
         return {self.id: result}
 
 
-class Matcher(object):
+class _ConditionProcessor(object):
+    """Base of the condition processors.  Every change of a public setting of a
+    processor owned by a ConditionHandler increments the revision of the handler.
+    """
+    _handler = None
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if self._handler is not None and not name.startswith('_'):
+            self._handler.revision += 1
+
+
+class Matcher(_ConditionProcessor):
     """Condition object that chacks if the given pattern id matches or not through the content.
     It has two parameters you can set up the desired behavior:
 
@@ -93,13 +208,37 @@ class Matcher(object):
         if not self.pattern_id:
             raise AttributeError('No pattern id was set..')
         else:
-            if self.pattern_id in data.keys():
+            if self.pattern_id in data:
                 return not self.is_inverted
             else:
                 return self.is_inverted
 
+    def compile(self, condition_id, c1, c2, namespace):
+        """Returns the Python expression of the condition for the compiled
+        condition function."""
+        if not self.pattern_id:
+            raise AttributeError('No pattern id was set..')
+        membership = 'not in' if self.is_inverted else 'in'
+        return '{!r} {} data'.format(self.pattern_id, membership)
+
+    def process_batch(self, c1, c2, data, length):
+        if not self.pattern_id:
+            raise AttributeError('No pattern id was set..')
+        _, matched = _get_batch_column(data, self.pattern_id, length)
+        if self.is_inverted:
+            return ~matched
+        return matched
+
+    def process_bits(self, c1, c2, data, full_mask):
+        if not self.pattern_id:
+            raise AttributeError('No pattern id was set..')
+        mask = _get_hit_mask(data.get(self.pattern_id, ()))
+        if self.is_inverted:
+            return ~mask & full_mask
+        return mask
 
-class Comparer(object):
+
+class Comparer(_ConditionProcessor):
     """This condition is be able to compare patterns and pattern groups to predefined
     values, by applying the predefined condition on them.  Automatic type parsing is
     happening too.
@@ -123,18 +262,133 @@ class Comparer(object):
             [==, !=, <, <=, >, >=]
     """
     def __init__(self):
-        self.value = ''
-        self.condition = '=='
+        self._value = ''
+        self._condition = '=='
+        self._comparator = None
         self.pattern_id = None
 
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._comparator = None
+
+    @property
+    def condition(self):
+        return self._condition
+
+    @condition.setter
+    def condition(self, condition):
+        self._condition = condition
+        self._comparator = None
+
     def process(self, c1, c2, data):
         if not self.pattern_id:
             raise AttributeError
         else:
-            ret = False
-            value = data[self.pattern_id]['match']
-            ret = Comparer._execute_condition(value, self.value, self.condition)
-            return ret
+            if self.pattern_id not in data:
+                return False
+            comparator = self._comparator or self.get_comparator()
+            return comparator(data[self.pattern_id]['match'])
+
+    def process_batch(self, c1, c2, data, length):
+        """Batch variant of process().  The matched contents are converted to
+        integers in one step if the value is a number, and compared in one step if
+        the value is a string compared with == or !=.  The contents the fast paths
+        cannot handle are compared one by one with the comparator."""
+        if not self.pattern_id:
+            raise AttributeError
+        column, matched = _get_batch_column(data, self.pattern_id, length)
+        if column is None:
+            return matched
+        comparator = self._comparator or self.get_comparator()
+        op = _COMPARISON_OPERATORS[self._condition]
+        value = Comparer._prepare_value(self._value)
+        contents = column[matched]
+
+        compared = None
+        if isinstance(value, bool):
+            pass
+        elif isinstance(value, (int, float)):
+            try:
+                compared = op(contents.astype(numpy.int64), value)
+            except (ValueError, TypeError, OverflowError):
+                pass
+        elif op is operator.eq or op is operator.ne:
+            compared = op(contents, value)
+        if compared is None:
+            compared = numpy.fromiter((comparator(c) for c in contents), dtype=bool,
+                                      count=len(contents))
+
+        ret = numpy.zeros(length, dtype=bool)
+        ret[matched] = compared
+        return ret
+
+    def process_bits(self, c1, c2, data, full_mask):
+        """Bitset variant of process(), only the hits of the pattern are compared."""
+        if not self.pattern_id:
+            raise AttributeError
+        comparator = self._comparator or self.get_comparator()
+        column = data.get(self.pattern_id, {})
+        return _get_hit_mask(index for index, content in column.items() if comparator(content))
+
+    def get_comparator(self):
+        """Returns the comparator function that takes the matched content and returns
+        the result of the condition.  The value is parsed and the operator is chosen
+        only once, when the value or the condition changes.  The comparator is
+        specialized for the type of the parsed value:
+
+            int, float: the content is parsed with int() first, the full type
+                        parsing is the fallback only for the other contents
+            str with == or !=: the unparsed content is compared, as only an
+                        unparsable content can be equal to an unparsable value
+            other cases: the content gets the full type parsing
+
+        Contents that cannot be compared with the value (None, or a parsed type
+        the operator does not support) make the comparator return False.
+
+        Raises: AttributeError
+        """
+        try:
+            op = _COMPARISON_OPERATORS[self._condition]
+        except KeyError:
+            raise AttributeError('Invalid condition: ' + self._condition)
+        value = Comparer._prepare_value(self._value)
+        prepare_value = Comparer._prepare_value
+
+        if isinstance(value, bool):
+            def comparator(content):
+                try:
+                    return op(prepare_value(content), value)
+                except TypeError:
+                    return False
+        elif isinstance(value, (int, float)):
+            def comparator(content):
+                try:
+                    try:
+                        parsed = int(content)
+                    except ValueError:
+                        parsed = prepare_value(content)
+                    return op(parsed, value)
+                except TypeError:
+                    return False
+        elif op is operator.eq or op is operator.ne:
+            def comparator(content):
+                if content is None:
+                    return False
+                return op(content, value)
+        else:
+            def comparator(content):
+                try:
+                    return op(prepare_value(content), value)
+                except TypeError:
+                    return False
+
+        self._comparator = comparator
+        return comparator
 
     @staticmethod
     def _prepare_value(v):
@@ -147,43 +401,38 @@ class Comparer(object):
                 try:
                     v = float(v)
                 except ValueError:
-                    p = re.compile('^(true|True)$')
-                    m = p.match(v)
-                    if m:
+                    if _TRUE_PATTERN.match(v):
                         v = True
-                    else:
-                        p = re.compile('^(false|False)$')
-                        m = p.match(v)
-                        if m:
-                            v = False
+                    elif _FALSE_PATTERN.match(v):
+                        v = False
         return v
 
     @staticmethod
     def _execute_condition(p1, p2, c):
         p1 = Comparer._prepare_value(p1)
         p2 = Comparer._prepare_value(p2)
-        if c == '==':
-            return p1 == p2
-        if c == '!=':
-            return p1 != p2
-        if c == '<':
-            return p1 < p2
-        if c == '<=':
-            return p1 <= p2
-        if c == '>':
-            return p1 > p2
-        if c == '>=':
-            return p1 >= p2
-        raise AttributeError('Invalid condition: ' + c)
+        try:
+            op = _COMPARISON_OPERATORS[c]
+        except KeyError:
+            raise AttributeError('Invalid condition: ' + c)
+        return op(p1, p2)
+
+    def compile(self, condition_id, c1, c2, namespace):
+        """Returns the Python expression of the condition for the compiled
+        condition function.  The comparator is bound as a constant of the
+        function."""
+        if not self.pattern_id:
+            raise AttributeError
+        namespace['compare_{}'.format(condition_id)] = self.get_comparator()
+        return '{0!r} in data and compare_{1}(data[{0!r}][\'match\'])'.format(
+            self.pattern_id, condition_id)
 
     def update(self, string):
-        relation_pattern = re.compile('\s*relation\s+"?([=<>!]+)"?\s*')
-        relation_match = relation_pattern.search(string)
+        relation_match = _RELATION_UPDATE_PATTERN.search(string)
         if relation_match:
             self.condition = relation_match.group(1)
 
-        value_pattern = re.compile('\s*value\s+("([^"]+)"|\'([^\']+)\')\s*')
-        value_match = value_pattern.search(string)
+        value_match = _VALUE_UPDATE_PATTERN.search(string)
         if value_match:
             if value_match.group(3):
                 self.value = value_match.group(3)
@@ -191,19 +440,93 @@ class Comparer(object):
                 self.value = value_match.group(2)
 
 
-class Relation(object):
+class Relation(_ConditionProcessor):
+    """Condition object that combines the results of its children with the given
+    relation [AND, OR, XOR].  A relation has two children by default, more
+    children can be added to it, the n-ary XOR is true for an odd number of true
+    children.  The first two child ids are passed as c1 and c2, the rest of them
+    as more.
+    """
     def __init__(self):
         self.relation = 'AND'
 
-    def process(self, c1, c2, data):
-        if self.relation == 'AND':
+    def process(self, c1, c2, data, more=()):
+        if more:
+            values = [data[c1], data[c2]]
+            values.extend(data[c] for c in more)
+            if self.relation == 'AND':
+                return all(values)
+            if self.relation == 'OR':
+                return any(values)
+            if self.relation == 'XOR':
+                return sum(1 for v in values if v) % 2 == 1
+        elif self.relation == 'AND':
             return data[c1] and data[c2]
-        if self.relation == 'OR':
+        elif self.relation == 'OR':
             return data[c1] or data[c2]
-        if self.relation == 'XOR':
+        elif self.relation == 'XOR':
             return (data[c1] or data[c2]) and not (data[c1] and data[c2])
         raise AttributeError('Invalid relation: ' + self.relation)
 
+    def short_circuit(self, first):
+        """Returns the result of the relation if it is decided by the result of the
+        given child alone, otherwise None."""
+        if self.relation == 'AND':
+            return False if not first else None
+        if self.relation == 'OR':
+            return True if first else None
+        if self.relation == 'XOR':
+            return None
+        raise AttributeError('Invalid relation: ' + self.relation)
+
+    def compile(self, condition_id, c1, c2, namespace, more=()):
+        """Returns the Python expression of the condition for the compiled
+        condition function.  The children are referred by their variables."""
+        if c1 is None or c2 is None:
+            raise AttributeError('Missing child for relation: ' + str(condition_id))
+        variables = ['c_{}'.format(c) for c in (c1, c2) + tuple(more)]
+        if self.relation == 'AND':
+            return ' and '.join(variables)
+        if self.relation == 'OR':
+            return ' or '.join(variables)
+        if self.relation == 'XOR':
+            if more:
+                return 'bool(' + ' ^ '.join(variables) + ')'
+            return '({0} or {1}) and not ({0} and {1})'.format(*variables)
+        raise AttributeError('Invalid relation: ' + self.relation)
+
+    def process_batch(self, c1, c2, data, length, more=()):
+        if self.relation == 'AND':
+            function = numpy.logical_and
+        elif self.relation == 'OR':
+            function = numpy.logical_or
+        elif self.relation == 'XOR':
+            function = numpy.logical_xor
+        else:
+            raise AttributeError('Invalid relation: ' + self.relation)
+        ret = function(data[c1], data[c2])
+        for c in more:
+            function(ret, data[c], out=ret)
+        return ret
+
+    def process_bits(self, c1, c2, data, full_mask, more=()):
+        ret = data[c1]
+        if self.relation == 'AND':
+            ret &= data[c2]
+            for c in more:
+                ret &= data[c]
+        elif self.relation == 'OR':
+            ret |= data[c2]
+            for c in more:
+                ret |= data[c]
+        elif self.relation == 'XOR':
+            ret ^= data[c2]
+            for c in more:
+                ret ^= data[c]
+        else:
+            raise AttributeError('Invalid relation: ' + self.relation)
+        return ret
+
 
 class Sequence(object):
     def __init__(self):
@@ -215,10 +538,36 @@ class Sequence(object):
 class ConditionHandler(object):
     """ConditionHandler is the holder object for the conditions.  It's main purpose is to
     provide an interface for condition creation linkage and processing.
+
+    Loop detection
+        The handler keeps a topological order of the conditions, where every
+        child comes before its parents.  A new link that agrees with the order
+        cannot close a loop, so it is accepted without any search.  Otherwise only
+        the conditions between the two ends of the link are searched and
+        reordered, and a link closing a loop is refused before the graph is
+        changed.
+
+    Evaluation plan
+        The conditions are processed in a topological order, where every condition
+        comes after its children.  The order is compiled once into a frozen plan,
+        and it is only recompiled after a condition was added or linked, so the
+        processing of a line is a straight loop over the plan.  Terminations get
+        the pattern results, relations get the results of the conditions
+        processed before them.
+
+    Revision
+        The revision is incremented on every change of the conditions made
+        through the handler, including the changes of the processor settings, so
+        the users of the results can tell if their cached results are still valid.
     """
     def __init__(self):
         self.prev_id = 0
+        self.revision = 0
         self.conditions = []
+        self._conditions_by_id = {}
+        self._order = {}
+        self._operand_order = {}
+        self._plan = None
 
     def _get_new_id(self):
         self.prev_id += 1
@@ -238,7 +587,12 @@ class ConditionHandler(object):
         new_condition = Condition(new_id)
         new_condition.is_termination = is_termination
         new_condition.condition_processor = processor
+        processor._handler = self
         self.conditions.append(new_condition)
+        self._conditions_by_id[new_id] = new_condition
+        self._order[new_id] = new_id
+        self._plan = None
+        self.revision += 1
         return new_id
 
     def _execute_arbitration(self):
@@ -248,26 +602,413 @@ class ConditionHandler(object):
         self.conditions.sort(key=lambda c: c.arbitration_value)
 
     def get_condition(self, wanted_id):
-        return [x for x in self.conditions if x.id == wanted_id][0]
+        try:
+            return self._conditions_by_id[wanted_id]
+        except KeyError:
+            raise IndexError('Invalid condition id: ' + str(wanted_id))
 
     def add_child_for(self, parent_id, child_index, child_id):
+        """Links the child condition into the given child slot of the parent.  A
+        child index right after the last slot adds a new slot, so relations can
+        have any number of children.
+
+        Raises: IndexError, ConditionLoopError
+        """
         parent = self.get_condition(parent_id)
         child = self.get_condition(child_id)
+        self._update_order(parent, child)
         parent.add_child(child_index, child)
-        self.loop_test(child)
+        self._plan = None
+        self._operand_order.pop(parent_id, None)
+        self.revision += 1
+
+    def _update_order(self, parent, child):
+        order = self._order
+        lower = order[child.id]
+        upper = order[parent.id]
+        if lower < upper:
+            return
+        if parent is child:
+            self._raise_loop_error([parent.id, parent.id])
+
+        forward = []
+        came_from = {parent: None}
+        stack = [parent]
+        while stack:
+            c = stack.pop()
+            forward.append(c)
+            for rel in c.related_conditions:
+                if rel is child:
+                    path = [child.id]
+                    while c is not None:
+                        path.append(c.id)
+                        c = came_from[c]
+                    self._raise_loop_error([parent.id] + path)
+                if rel not in came_from and order[rel.id] < lower:
+                    came_from[rel] = c
+                    stack.append(rel)
+
+        backward = []
+        visited = set([child])
+        stack = [child]
+        while stack:
+            c = stack.pop()
+            backward.append(c)
+            for grandchild in c.children:
+                if grandchild and grandchild not in visited and order[grandchild.id] > upper:
+                    visited.add(grandchild)
+                    stack.append(grandchild)
+
+        affected = sorted(backward, key=lambda c: order[c.id]) + \
+            sorted(forward, key=lambda c: order[c.id])
+        slots = sorted(order[c.id] for c in affected)
+        for c, slot in zip(affected, slots):
+            order[c.id] = slot
+
+    @staticmethod
+    def _raise_loop_error(path):
+        raise ConditionLoopError(
+            'Condition loop: ' + ' -> '.join(str(i) for i in path), path)
 
     def loop_test(self, child):
-        for rel in child.related_conditions:
-            if rel._loop_protocol(child):
-                raise ConditionLoopError()
+        """Checks if the given condition is part of a loop by walking its children.
+
+        Raises: ConditionLoopError
+        """
+        came_from = {child: None}
+        stack = [child]
+        while stack:
+            c = stack.pop()
+            for grandchild in c.children:
+                if grandchild is child:
+                    path = [child.id]
+                    while c is not None:
+                        path.append(c.id)
+                        c = came_from[c]
+                    self._raise_loop_error(path[::-1])
+                if grandchild and grandchild not in came_from:
+                    came_from[grandchild] = c
+                    stack.append(grandchild)
+
+    def get_plan(self):
+        """Returns the evaluation plan, compiles it first if the conditions were
+        changed since the last compilation.
+
+        returned_tuple = (
+            (<condition id>, <condition processor>, <is termination>, <child id 1>, <child id 2>,
+             <tuple of the further child ids of n-ary relations>),
+            ...
+        )
+
+        Raises: ConditionLoopError
+        """
+        if self._plan is None:
+            self._plan = self._compile_plan()
+        return self._plan
+
+    def _compile_plan(self):
+        pending = {}
+        for c in self.conditions:
+            pending[c] = len(set(child for child in c.children if child))
+        ready = deque(c for c in self.conditions if pending[c] == 0)
+        plan = []
+        while ready:
+            c = ready.popleft()
+            ids = [child.id if child else None for child in c.children]
+            plan.append((c.id, c.condition_processor, c.is_termination, ids[0], ids[1],
+                         tuple(ids[2:])))
+            for parent in set(c.related_conditions):
+                pending[parent] -= 1
+                if pending[parent] == 0:
+                    ready.append(parent)
+        if len(plan) != len(self.conditions):
+            raise ConditionLoopError()
+        return tuple(plan)
 
     def process(self, data):
-        self._execute_arbitration()
         ret = {}
-        for c in self.conditions:
-            ret.update(c.process(data))
+        for condition_id, processor, is_termination, c1, c2, more in self.get_plan():
+            if is_termination:
+                ret[condition_id] = processor.process(c1, c2, data)
+            elif more:
+                ret[condition_id] = processor.process(c1, c2, ret, more)
+            else:
+                ret[condition_id] = processor.process(c1, c2, ret)
+        return ret
+
+    def process_batch(self, columns, length):
+        """Batch variant of process() for a block of lines.  The pattern results
+        are given in columns, one sequence per pattern id with the matched content
+        for every line, or None where the pattern did not match.  Patterns without
+        a column did not match in any of the lines.  Requires numpy.
+
+        columns = {
+            'A': ['hello', None, 'hi', ...],
+            'A1': ['3', None, '42', ...]
+        }
+
+        returned_dictionary = {
+            <condition id>: <numpy boolean array of the length>,
+            ...
+        }
+
+        Raises: ImportError, ValueError
+        """
+        if numpy is None:
+            raise ImportError('numpy is required for batch processing')
+        ret = {}
+        for condition_id, processor, is_termination, c1, c2, more in self.get_plan():
+            if is_termination:
+                ret[condition_id] = processor.process_batch(c1, c2, columns, length)
+            else:
+                ret[condition_id] = processor.process_batch(c1, c2, ret, length, more)
+        return ret
+
+    def process_bits(self, hits, length):
+        """Bitset variant of process() for a block of lines without any dependency.
+        The pattern results are given in sparse columns, see collect_hits(), and
+        every condition results in one int, where the bit n is set if the
+        condition is true for the line n of the block.  The relations are single
+        bitwise operations over the whole block, the terminations only visit the
+        hits of their pattern.  Use iter_set_bits() or unpack_bits() to get the
+        per line results back.
+
+        returned_dictionary = {
+            <condition id>: <bitmask>,
+            ...
+        }
+        """
+        full_mask = (1 << length) - 1
+        ret = {}
+        for condition_id, processor, is_termination, c1, c2, more in self.get_plan():
+            if is_termination:
+                ret[condition_id] = processor.process_bits(c1, c2, hits, full_mask)
+            else:
+                ret[condition_id] = processor.process_bits(c1, c2, ret, full_mask, more)
         return ret
 
+    def process_lazy(self, data, root_ids, statistics=None):
+        """Demand driven variant of process().  Only the conditions needed for the
+        given root conditions are processed, and the AND and OR relations skip
+        their second child if the first one already decided the result.  The
+        returned dictionary contains the results of the roots and of every
+        condition that had to be processed for them.  The children of a relation
+        are processed in the order set by reorder_operands(), which changes only
+        the set of the processed conditions, not the results.
+
+        The graph is walked with an explicit stack, so deep graphs do not hit the
+        recursion limit.
+
+        If a statistics dictionary is given, the processed conditions are counted
+        in it:
+
+        statistics = {
+            <condition id>: [<processings>, <true results>],
+            ...
+        }
+        """
+        ret = {}
+        # index of the first child of the relations not checked yet
+        progress = {}
+        operand_order = self._operand_order
+        stack = [self.get_condition(root_id) for root_id in root_ids]
+        while stack:
+            c = stack[-1]
+            if c.id in ret:
+                stack.pop()
+                continue
+            processor = c.condition_processor
+            if c.is_termination:
+                ret[c.id] = processor.process(None, None, data)
+                stack.pop()
+                continue
+            children = operand_order.get(c.id) or c.children
+            index = progress.get(c.id, 0)
+            decided = None
+            while index < len(children):
+                child = children[index]
+                if child is None:
+                    raise AttributeError('Missing child for relation: ' + str(c.id))
+                if child.id not in ret:
+                    break
+                decided = processor.short_circuit(ret[child.id])
+                if decided is not None:
+                    break
+                index += 1
+            if decided is not None:
+                ret[c.id] = decided
+                stack.pop()
+            elif index < len(children):
+                progress[c.id] = index
+                stack.append(children[index])
+            else:
+                ids = [child.id for child in children]
+                ret[c.id] = processor.process(ids[0], ids[1], ret, tuple(ids[2:]))
+                stack.pop()
+        if statistics is not None:
+            for condition_id, result in ret.items():
+                counters = statistics.get(condition_id)
+                if counters is None:
+                    counters = statistics[condition_id] = [0, 0]
+                counters[0] += 1
+                if result:
+                    counters[1] += 1
+        return ret
+
+    def reorder_operands(self, pattern_costs, statistics, hysteresis=0.1):
+        """Sets the order of the children of the AND and OR relations for
+        process_lazy() by their observed cost and selectivity, so the cheap
+        children that decide the relation alone are processed first.  The cost
+        of a termination is the cost of its pattern, the cost of a relation is
+        the expected cost of its children in their order:
+
+            cost = cost(1st) + P(1st does not decide) * cost(2nd) + ...
+
+        The children are sorted by their cost per deciding probability, and the
+        new order is only set if the expected cost drops more than the hysteresis
+        ratio, so noisy statistics do not flip the order back and forth.  It
+        returns the number of reordered relations.
+
+            pattern_costs: average execution time keyed with the main pattern ids
+            statistics: condition statistics collected by process_lazy()
+        """
+        costs = {}
+        probabilities = {}
+        reorders = 0
+        for condition_id, processor, is_termination, c1, c2, more in self.get_plan():
+            counters = statistics.get(condition_id)
+            if counters and counters[0]:
+                probabilities[condition_id] = float(counters[1]) / counters[0]
+            else:
+                probabilities[condition_id] = 0.5
+            if is_termination:
+                pattern_id = processor.pattern_id or ''
+                costs[condition_id] = pattern_costs.get(pattern_id.rstrip('0123456789'), 0.0)
+                continue
+            if c1 is None or c2 is None:
+                continue
+            condition = self.get_condition(condition_id)
+            children = self._operand_order.get(condition_id) or tuple(condition.children)
+            if processor.relation not in ('AND', 'OR'):
+                costs[condition_id] = sum(costs[child.id] for child in children)
+                continue
+
+            if processor.relation == 'AND':
+                undecided = dict((child.id, probabilities[child.id]) for child in children)
+            else:
+                undecided = dict((child.id, 1.0 - probabilities[child.id]) for child in children)
+
+            def expected_cost(order):
+                ret = 0.0
+                reached = 1.0
+                for child in order:
+                    ret += reached * costs[child.id]
+                    reached *= undecided[child.id]
+                return ret
+
+            def rank(child):
+                deciding = 1.0 - undecided[child.id]
+                if deciding <= 0.0:
+                    return float('inf')
+                return costs[child.id] / deciding
+
+            current = expected_cost(children)
+            ordered = tuple(sorted(children, key=rank))
+            cost = expected_cost(ordered)
+            if ordered != children and cost < current * (1.0 - hysteresis):
+                self._operand_order[condition_id] = ordered
+                reorders += 1
+                current = cost
+            costs[condition_id] = current
+        return reorders
+
+    def normalize(self):
+        """Flattens the nested relations with the same operator into n-ary
+        relations, and removes the duplicate children of the AND and OR
+        relations, so generated rule sets are processed with as few levels as
+        possible.  The results of the conditions do not change.  The inlined
+        relations are kept as they are, so their results are still available.
+        It returns the number of the changed relations.
+        """
+        changed = 0
+        for condition_id, processor, is_termination, c1, c2, more in self.get_plan():
+            c = self.get_condition(condition_id)
+            if is_termination or None in c.children:
+                continue
+            children = []
+            for child in c.children:
+                if not child.is_termination and None not in child.children and \
+                        child.condition_processor.relation == processor.relation:
+                    children.extend(child.children)
+                else:
+                    children.append(child)
+            if processor.relation in ('AND', 'OR'):
+                unique = []
+                seen = set()
+                for child in children:
+                    if child.id not in seen:
+                        seen.add(child.id)
+                        unique.append(child)
+                # a relation keeps at least two children
+                children = unique if len(unique) > 1 else unique * 2
+            if children != c.children:
+                c.set_children(children)
+                self._operand_order.pop(condition_id, None)
+                changed += 1
+        if changed:
+            self._plan = None
+            self.revision += 1
+        return changed
+
+    def get_required_pattern_ids(self, root_ids):
+        """Returns the pattern ids the given root conditions may read, so the
+        patterns nobody will read can be left out from the pattern execution."""
+        ret = set()
+        visited = set()
+        stack = [self.get_condition(root_id) for root_id in root_ids]
+        while stack:
+            c = stack.pop()
+            if c.id in visited:
+                continue
+            visited.add(c.id)
+            if c.is_termination:
+                if c.condition_processor.pattern_id:
+                    ret.add(c.condition_processor.pattern_id)
+            else:
+                stack.extend(child for child in c.children if child)
+        return ret
+
+    def compile(self, explain=False):
+        """Compiles the conditions into one generated Python function that takes
+        the pattern results and returns the same dictionary as process().  Every
+        condition becomes a single assignment in plan order, so there is no
+        dispatching or string comparison left for the processing of a line.
+        The processor settings are read at compile time, the function has to be
+        compiled again after they are changed.
+
+        The generated source is available as the source attribute of the function.
+        If explain is set, the source is printed as well.
+
+        Raises: ConditionLoopError, AttributeError
+        """
+        namespace = {}
+        lines = ['def process_conditions(data):']
+        for condition_id, processor, is_termination, c1, c2, more in self.get_plan():
+            if is_termination:
+                expression = processor.compile(condition_id, c1, c2, namespace)
+            else:
+                expression = processor.compile(condition_id, c1, c2, namespace, more)
+            lines.append('    c_{} = {}'.format(condition_id, expression))
+        results = ', '.join('{0!r}: c_{0}'.format(c.id) for c in self.conditions)
+        lines.append('    return {' + results + '}')
+        source = '\n'.join(lines) + '\n'
+        exec(compile(source, '<compiled conditions>', 'exec'), namespace)
+        function = namespace['process_conditions']
+        function.source = source
+        if explain:
+            print(source)
+        return function
+
     def update(self, param):
         pass
 
@@ -1,4 +1,25 @@
+import io
+import mmap
+import multiprocessing
+import os
 import re
+from collections import OrderedDict, deque
+from timeit import default_timer
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+# Default size of the blocks read from the scanned sources.  Lines are cut out
+# of these blocks, so the memory usage only depends on this value and on the
+# length of the longest line, not on the size of the scanned file.
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Default size of the file parts the parallel scan hands over to the workers.
+DEFAULT_PARALLEL_CHUNK_SIZE = 16 * 1024 * 1024
 
 
 class InvalidPatternIdError(SyntaxError):
@@ -9,29 +30,467 @@ class NoPatternError(Exception):
     pass
 
 
+_ID_PATTERN = re.compile('([A-Z]+)(\\d*)$')
+
+# Parsed ids keyed with the raw ids.  Ids are parsed on every lookup, so the
+# regexp runs only once per distinct id.
+_parsed_id_cache = {}
+_PARSED_ID_CACHE_LIMIT = 65536
+
+
 def _parse_id(raw_id):
     """Translates pattern ids to indexes.  The first pattern can be identified as A,
-    the second is B and so on.  Pattern groups can be indexed with numbers.  For
-    example, you can index the second pattern's second group with B2.  The method
-    returns a tuple with two element.
+    the second is B and so on.  After Z the ids continue with AA, AB, ... ZZ, AAA.
+    Pattern groups can be indexed with numbers.  For example, you can index the
+    second pattern's second group with B2.  The method returns a dictionary with
+    two elements.
 
     returned_dictionary = {
-        'main': <pattern indexes from 0>,
+        'main': <pattern id letters>,
         'group': <group indexes from 1. 0 indexes the whole pattern>
     }
     """
-    p = re.compile('([A-Z])(\d{,2})')
-    m = p.match(raw_id)
-    if m:
-        main_index = m.group(1)
-        try:
-            group_index = int(m.group(2))
-        except ValueError:
-            group_index = 0
-        parsed_id = {'main': main_index, 'group': group_index}
-        return parsed_id
+    parsed_id = _parsed_id_cache.get(raw_id)
+    if parsed_id is None:
+        m = _ID_PATTERN.match(raw_id)
+        if not m:
+            raise InvalidPatternIdError('Invalid ID: ' + raw_id)
+        group_index = int(m.group(2)) if m.group(2) else 0
+        parsed_id = {'main': m.group(1), 'group': group_index}
+        if len(_parsed_id_cache) >= _PARSED_ID_CACHE_LIMIT:
+            _parsed_id_cache.clear()
+        _parsed_id_cache[raw_id] = parsed_id
+    return dict(parsed_id)
+
+
+def _main_id_for_number(number):
+    """Returns the main id of the number-th pattern counted from 1: A, B, ... Z,
+    AA, AB, ... ZZ, AAA, ...
+    """
+    letters = []
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        letters.append(chr(ord('A') + remainder))
+    return ''.join(reversed(letters))
+
+
+def _is_bytes(value):
+    return isinstance(value, bytes) and not isinstance(value, str)
+
+
+def _open_source(source):
+    """Returns a readable stream for the given source and a flag that tells if
+    the stream was opened here and has to be closed by the caller.  File paths
+    are opened in binary mode, file objects are used as they are.
+    """
+    if hasattr(source, 'read'):
+        return source, False
+    return open(source, 'rb'), True
+
+
+def _iter_lines(stream, chunk_size, encoding, errors):
+    """Generator that reads the stream in chunk_size sized blocks and yields the
+    lines found in them one by one.
+
+    yielded_tuple = (<line number from 1>, <offset of the line start>, <line>)
+
+    The offset is a byte offset for binary streams and a character offset for
+    text streams.  Line endings ('\\n' and '\\r\\n') are stripped from the yielded
+    lines, binary lines are decoded with the given encoding.
+    """
+    line_number = 0
+    offset = 0
+    pending = None
+    decode = None
+    newline = None
+    carriage_return = None
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if decode is None:
+            decode = _is_bytes(chunk)
+            newline = b'\n' if decode else '\n'
+            carriage_return = b'\r' if decode else '\r'
+        if pending:
+            chunk = pending + chunk
+        lines = chunk.split(newline)
+        pending = lines.pop()
+        for line in lines:
+            line_number += 1
+            line_length = len(line) + 1
+            if line[-1:] == carriage_return:
+                line = line[:-1]
+            if decode:
+                line = line.decode(encoding, errors)
+            yield line_number, offset, line
+            offset += line_length
+    if pending:
+        if pending[-1:] == carriage_return:
+            pending = pending[:-1]
+        if decode:
+            pending = pending.decode(encoding, errors)
+        yield line_number + 1, offset, pending
+
+
+def _split_file(path, chunk_size):
+    """Splits the file into (start, end) byte ranges of about chunk_size bytes.
+    Every range ends right after a newline character or at the end of the file,
+    so no line is split between two ranges.
+    """
+    ranges = []
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        start = 0
+        while start < size:
+            end = start + max(chunk_size, 1)
+            if end < size:
+                f.seek(end - 1)
+                end += len(f.readline()) - 1
+            else:
+                end = size
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+# PatternHandler instances of a worker process keyed with their snapshots, so
+# the patterns are compiled once per worker, not once per chunk.  Only the pool
+# workers use it, they live as long as one parallel scan.  Scans running in the
+# calling process use a per-call dictionary instead, so the handlers of the
+# past scans are not kept alive.
+_worker_handlers = {}
+
+
+def _scan_file_range(task, handlers=_worker_handlers):
+    """Worker function of the parallel scan.  Executes the patterns of the given
+    snapshot on the lines of the byte range of the file.  The handler built from
+    the snapshot is cached in the handlers dictionary.
+
+    returned_tuple = (<number of lines in the range>, [(<line number in the range>, <offset>, <result>), ...])
+    """
+    snapshot, path, start, end, encoding, errors, only_matches = task
+    handler = handlers.get(snapshot)
+    if handler is None:
+        handler = PatternHandler.from_snapshot(snapshot)
+        handlers[snapshot] = handler
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    execute = handler.execute
+    results = []
+    line_count = 0
+    for line_number, offset, line in _iter_lines(io.BytesIO(data), len(data) or 1, encoding, errors):
+        line_count = line_number
+        result = execute(line)
+        if result or not only_matches:
+            results.append((line_number, start + offset, result))
+    return line_count, results
+
+
+def _imap_bounded(pool, function, tasks, window):
+    """Ordered variant of Pool.imap() with backpressure.  At most window tasks
+    are submitted to the pool and not yet taken by the caller, so the results
+    of a fast pool do not pile up in memory while the caller is busy.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+class _ViewBuffer(object):
+    """Buffer over a part of a larger object exposed by a memoryview.  Memoryviews
+    do not tell where they start in their object, so the object's own find()
+    cannot be used on the part.  find() runs bounded regexp searches on the view
+    instead, and slices are views of the view, so nothing is copied.
+
+    :type view: memoryview
+    """
+    __slots__ = ('view', '_searches')
+
+    def __init__(self, view):
+        self.view = view
+        self._searches = {}
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, index):
+        return self.view[index]
+
+    def find(self, sub, start=0, end=None):
+        search = self._searches.get(sub)
+        if search is None:
+            search = re.compile(re.escape(sub)).search
+            self._searches[sub] = search
+        m = search(self.view, start, len(self.view) if end is None else end)
+        return m.start() if m else -1
+
+
+def _open_buffer(source):
+    """Returns a buffer supporting find() for the given source and a flag that
+    tells if the buffer was created here and has to be closed by the caller.  File
+    paths are memory mapped, bytes, bytearray and mmap objects are used as they
+    are.  Memoryviews are resolved to the object they expose if they cover the
+    whole object, contiguous views of a part of an object are wrapped into a
+    _ViewBuffer, and only the content of non contiguous views is copied.
+    """
+    if isinstance(source, memoryview):
+        obj = source.obj
+        if not source.contiguous:
+            return source.tobytes(), False
+        if isinstance(obj, (bytes, bytearray, mmap.mmap)) and source.nbytes == len(obj):
+            return obj, False
+        if source.ndim != 1 or source.itemsize != 1:
+            source = source.cast('B')
+        return _ViewBuffer(source), False
+    if isinstance(source, (bytes, bytearray, mmap.mmap)) and not isinstance(source, str):
+        return source, False
+    with open(source, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b'', False
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), True
+
+
+def _iter_buffer_lines(buffer):
+    """Generator that yields the position of the lines of the buffer without
+    copying them.
+
+    yielded_tuple = (<line number from 1>, <offset of the line start>, <offset of the line end>)
+
+    The end offset excludes the line ending ('\\n' or '\\r\\n').
+    """
+    find = buffer.find
+    size = len(buffer)
+    line_number = 0
+    start = 0
+    while start < size:
+        line_number += 1
+        end = find(b'\n', start)
+        if end == -1:
+            end = size
+        next_start = end + 1
+        if end > start and buffer[end - 1:end] == b'\r':
+            end -= 1
+        yield line_number, start, end
+        start = next_start
+
+
+_LITERAL_REPEATS = tuple(getattr(sre_constants, name) for name in
+                         ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+                         if hasattr(sre_constants, name))
+
+
+def _extract_required_literals(expression, flags=0):
+    """Returns the literal substrings that every match of the given expression
+    has to contain, longest first.  The literals are collected from the parse tree
+    of the expression: literal runs of the main sequence, of the groups and of
+    the repeats that have to occur at least once.  Alternations, character sets
+    and assertions are skipped.  Case insensitive expressions have no required
+    literals.
+    """
+    try:
+        parsed = sre_parse.parse(expression, flags)
+    except (re.error, TypeError, ValueError):
+        return ()
+    state = getattr(parsed, 'state', None) or getattr(parsed, 'pattern', None)
+    if state is not None:
+        flags |= state.flags
+    if flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return ()
+    if _is_bytes(expression):
+        join = lambda run: bytes(bytearray(run))
     else:
-        raise InvalidPatternIdError('Invalid ID: ' + raw_id)
+        join = lambda run: ''.join(chr(c) for c in run)
+    literals = []
+    _collect_literals(parsed, literals, join)
+    unique = []
+    for literal in literals:
+        if literal not in unique:
+            unique.append(literal)
+    return tuple(sorted(unique, key=len, reverse=True))
+
+
+def _collect_literals(items, literals, join):
+    run = []
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            run.append(av)
+            continue
+        if run:
+            literals.append(join(run))
+            run = []
+        if op is sre_constants.SUBPATTERN:
+            add_flags = av[1] if len(av) == 4 else 0
+            if not add_flags & sre_constants.SRE_FLAG_IGNORECASE:
+                _collect_literals(av[-1], literals, join)
+        elif op in _LITERAL_REPEATS:
+            if av[0] >= 1:
+                _collect_literals(av[2], literals, join)
+        elif op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+            _collect_literals(av, literals, join)
+    if run:
+        literals.append(join(run))
+
+
+def _find_group_sources(expression, verbose):
+    """Returns the source text of the capturing groups of the expression in group
+    number order.  The expression is tokenized just enough to tell the capturing
+    groups apart from the non capturing ones, the extensions, the character sets,
+    the escaped characters and the verbose mode comments.
+    """
+    text = expression.decode('latin-1') if _is_bytes(expression) else expression
+    sources = []
+    stack = []
+    i = 0
+    length = len(text)
+    while i < length:
+        c = text[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '[':
+            i += 1
+            if text[i:i + 1] == '^':
+                i += 1
+            if text[i:i + 1] == ']':
+                i += 1
+            while i < length and text[i] != ']':
+                i += 2 if text[i] == '\\' else 1
+        elif verbose and c == '#':
+            while i < length and text[i] != '\n':
+                i += 1
+        elif c == '(':
+            if text.startswith('(?#', i):
+                i = text.find(')', i)
+                if i == -1:
+                    break
+            elif text.startswith('(?(', i):
+                # conditional group, the group reference is not a group
+                stack.append(None)
+                i = text.find(')', i + 3)
+                if i == -1:
+                    break
+            else:
+                named = text.startswith('(?P<', i) or (text.startswith('(?<', i) and
+                                                       text[i + 3:i + 4] not in ('=', '!'))
+                capturing = named or text[i + 1:i + 2] != '?'
+                if capturing:
+                    stack.append(len(sources))
+                    sources.append(i)
+                else:
+                    stack.append(None)
+        elif c == ')' and stack:
+            index = stack.pop()
+            if index is not None:
+                sources[index] = expression[sources[index]:i + 1]
+        i += 1
+    return sources
+
+
+def _compile_expression(expression, flags):
+    """Compiles the expression and collects the metadata the Pattern objects need.
+    The group table is derived from the compiled pattern: its group count and the
+    names of the named groups.  The source texts of the groups are collected for
+    displaying purpose.
+
+    returned_tuple = (
+        <compiled pattern>,
+        <groups tuple: the expression and the source text of every group>,
+        <group names tuple: None for the whole pattern and for the unnamed groups>,
+        <required literals tuple>
+    )
+
+    Raises: re.error
+    """
+    compiled = re.compile(expression, flags)
+    group_count = compiled.groups
+    sources = _find_group_sources(expression, compiled.flags & re.VERBOSE)
+    if len(sources) != group_count or any(isinstance(source, int) for source in sources):
+        sources = [expression[:0]] * group_count
+    names = [None] * (group_count + 1)
+    for name, index in compiled.groupindex.items():
+        names[index] = name
+    groups = (expression,) + tuple(sources)
+    return compiled, groups, tuple(names), _extract_required_literals(expression, flags)
+
+
+class _CompiledPatternCache(object):
+    """Process wide least recently used cache for the compiled expressions and
+    their metadata keyed with the expression and the flags.  It is shared by every
+    Pattern object, so an expression is compiled only once even if it is used in
+    several handlers, or if an earlier expression is set again during editing.
+    A zero max_size disables the caching.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, expression, flags):
+        key = (expression.__class__, expression, flags)
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+            self.entries[key] = entry
+            return entry
+        self.misses += 1
+        entry = _compile_expression(expression, flags)
+        if self.max_size > 0:
+            self.entries[key] = entry
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def resize(self, max_size):
+        self.max_size = max_size
+        while len(self.entries) > max(max_size, 0):
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0
+        }
+
+
+_pattern_cache = _CompiledPatternCache(256)
+
+
+def set_pattern_cache_size(max_size):
+    """Sets the maximum number of compiled expressions kept in the process wide
+    pattern cache.  Zero disables the caching.
+    """
+    _pattern_cache.resize(max_size)
+
+
+def get_pattern_cache_info():
+    """Returns the statistics of the process wide pattern cache.
+
+    returned_dictionary_example = {
+        'size': 12, 'max_size': 256, 'hits': 30, 'misses': 12, 'hit_rate': 0.714...
+    }
+    """
+    return _pattern_cache.info()
+
+
+def clear_pattern_cache():
+    """Drops every cached expression and resets the cache statistics."""
+    _pattern_cache.clear()
 
 
 class Pattern(object):
@@ -44,13 +503,29 @@ class Pattern(object):
     and it's corresponding compiled pattern object.  It collects the raw groups
     as well for displaying purpose.
 
+    The literal substrings every match has to contain are collected as well.
+    Texts missing any of them are rejected without running the regexp engine.
+    The prefilter_hits counter counts the rejected texts, prefilter_misses counts
+    the texts that passed the prefilter and had to be searched.
+
     :type pattern: _sre.SRE_Pattern  # compiled re pattern object
     :type groups: tuple              # regexp groups including the pattern itself at the first place
+    :type group_count: int           # number of capturing groups
+    :type group_names: tuple         # group names, None for the pattern itself and unnamed groups
+    :type literals: tuple            # required literals, longest first
+    :type flags: int                 # flags the expression was compiled with
     """
 
     def __init__(self):
         self.pattern = None
         self.groups = ('',)
+        self.group_count = 0
+        self.group_names = (None,)
+        self.flags = 0
+        self._id_table = None
+        self.literals = ()
+        self.prefilter_hits = 0
+        self.prefilter_misses = 0
 
     def __str__(self):
         if self.pattern:
@@ -61,25 +536,26 @@ class Pattern(object):
         else:
             return 'An empty pattern'
 
-    def add_expression(self, pattern):
+    def add_expression(self, pattern, flags=0):
         """Interface method for adding and validating regular expressions.  The given
         pattern string will be validated and will be saved if passed the validation.
         Regexp groups will be separated and will be accessible via the groups property.
+        The compiled expressions are taken from the process wide pattern cache.
 
         :type pattern: str
+        :type flags: int
 
         :raises: SyntaxError
         """
         try:
-            self.pattern = re.compile(pattern)
-            temp_groups = list(re.findall('(\([^\(]+\))', pattern))
-            if temp_groups:
-                temp_groups.insert(0, pattern)
-            else:
-                temp_groups = [pattern]
-            self.groups = tuple(temp_groups)
+            self.pattern, self.groups, self.group_names, self.literals = _pattern_cache.get(pattern, flags)
+            self.group_count = self.pattern.groups
+            self.flags = flags
+            self._id_table = None
+            self.prefilter_hits = 0
+            self.prefilter_misses = 0
         except re.error:
-            raise SyntaxError('Invalid regular expression: "' + pattern + '"')
+            raise SyntaxError('Invalid regular expression: {}'.format(repr(pattern)))
 
     def execute(self, raw_text):
         """Method for producing pattern results.  If the pattern matches, this method
@@ -102,33 +578,330 @@ class Pattern(object):
 
         If the pattern couldn't match None will be returned.
         """
+        result = self.match(raw_text)
+        if result:
+            return result.as_dict()
+        return None
+
+    def match(self, raw_text):
+        """Lightweight variant of execute().  It runs a single search and returns
+        a MatchResult object wrapping the match, or None if the pattern couldn't
+        match.  Group contents and spans are only produced when they are read.
+        """
         if not self.pattern:
             raise ValueError('Pattern has to be initialized with some value')
-
-        # construct group matches from index
+        if self.literals and not self._passes_prefilter(raw_text):
+            return None
         m = self.pattern.search(raw_text)
         if m:
-            ret = {
-                'results': [],
-                'spans': []
-            }
-            for i in range(1, len(m.groups()) + 1):
-                group = m.group(i)
-                start = m.start(i)
-                group_len = len(group)
-                ret['results'].append(group)
-                ret['spans'].append((start, start + group_len))
-
-            # construct whole pattern match
-            m = self.pattern.search(raw_text)
-            ret['results'].insert(0, m.group())
-            ret['spans'].insert(0, m.span())
-
-            # convert lists to tuples
-            ret['results'] = tuple(ret['results'])
-            ret['spans'] = tuple(ret['spans'])
+            return MatchResult(m, 0, self.group_count)
+        return None
+
+    def iter_matches(self, raw_text):
+        """Generator that yields a MatchResult for every non overlapping occurrence
+        of the pattern in the given text, from left to right.
+        """
+        if not self.pattern:
+            raise ValueError('Pattern has to be initialized with some value')
+        if self.literals and not self._passes_prefilter(raw_text):
+            return
+        group_count = self.group_count
+        for m in self.pattern.finditer(raw_text):
+            yield MatchResult(m, 0, group_count)
+
+    def count(self, raw_text):
+        """Returns the number of non overlapping occurrences of the pattern in the
+        given text without producing any match content.
+        """
+        if not self.pattern:
+            raise ValueError('Pattern has to be initialized with some value')
+        if self.literals and not self._passes_prefilter(raw_text):
+            return 0
+        n = 0
+        for _ in self.pattern.finditer(raw_text):
+            n += 1
+        return n
+
+    def match_slice(self, buffer, start, end, line):
+        """Variant of match() for a line of a larger bytes buffer.  The line has to
+        be the zero copy memoryview slice buffer[start:end].  The literal prefilter
+        runs on the buffer with find(), and the regexp searches the slice, so the
+        line is neither copied nor decoded.  The spans are byte offsets relative
+        to start.
+        """
+        if not self.pattern:
+            raise ValueError('Pattern has to be initialized with some value')
+        if self.literals:
+            for literal in self.literals:
+                if buffer.find(literal, start, end) == -1:
+                    self.prefilter_hits += 1
+                    return None
+            self.prefilter_misses += 1
+        m = self.pattern.search(line)
+        if m:
+            return MatchResult(m, 0, self.group_count)
+        return None
+
+    def get_ids(self, main_id):
+        """Returns the full id tuple of the pattern for the given main id: the main
+        id itself followed by the group ids.  The tuple is built once per main id
+        and expression.
+        """
+        return self._get_id_table(main_id)[1]
+
+    def get_group_name_ids(self, main_id):
+        """Returns the group ids of the named groups keyed with the group names."""
+        return self._get_id_table(main_id)[2]
+
+    def _get_id_table(self, main_id):
+        table = self._id_table
+        if table is None or table[0] != main_id:
+            ids = (main_id,) + tuple(main_id + str(i) for i in range(1, self.group_count + 1))
+            name_ids = dict((name, ids[i]) for i, name in enumerate(self.group_names) if name)
+            table = (main_id, ids, name_ids)
+            self._id_table = table
+        return table
+
+    def _passes_prefilter(self, raw_text):
+        if raw_text.__class__ is memoryview:
+            # memoryview has no substring search
+            return True
+        for literal in self.literals:
+            if literal not in raw_text:
+                self.prefilter_hits += 1
+                return False
+        self.prefilter_misses += 1
+        return True
+
+
+class MatchResult(object):
+    """Compact pattern result that wraps a regexp match object.  The group
+    contents and spans are taken from the match object only when they are read,
+    so a match costs a single object allocation.
+
+    The whole pattern is indexed with 0, the groups with 1..group_count.  The
+    base is the index of the whole pattern's group in the match object, which
+    is 0 for standalone matches and the wrapper group for union matches.
+
+    :type match_object: _sre.SRE_Match
+    :type base: int
+    :type group_count: int
+    """
+    __slots__ = ('match_object', 'base', 'group_count')
+
+    def __init__(self, match_object, base, group_count):
+        self.match_object = match_object
+        self.base = base
+        self.group_count = group_count
+
+    def __len__(self):
+        return self.group_count + 1
+
+    def __repr__(self):
+        return 'MatchResult({!r}, {!r})'.format(self.results, self.spans)
+
+    def group(self, index=0):
+        return self.match_object.group(self.base + index)
+
+    def span(self, index=0):
+        return self.match_object.span(self.base + index)
+
+    @property
+    def results(self):
+        m = self.match_object
+        return tuple(m.group(i) for i in range(self.base, self.base + self.group_count + 1))
+
+    @property
+    def spans(self):
+        m = self.match_object
+        return tuple(m.span(i) for i in range(self.base, self.base + self.group_count + 1))
+
+    def text(self, index=0, encoding='utf-8', errors='replace'):
+        """Returns the content of the given group as a string.  Contents of bytes
+        patterns are decoded here, only when they are asked for.
+        """
+        content = self.match_object.group(self.base + index)
+        if _is_bytes(content):
+            return content.decode(encoding, errors)
+        return content
+
+    def as_dict(self):
+        """Adapter for the Pattern.execute() result format."""
+        return {'results': self.results, 'spans': self.spans}
+
+
+def _flatten_matches(matches, entries):
+    """Adapter that converts the {main id: MatchResult} mapping of
+    PatternHandler.match() to the PatternHandler.execute() result format.  The
+    keys are taken from the id tables of the patterns in the entries mapping.
+    Groups that did not take part in the match get no key, so a missing id
+    always means no match.
+    """
+    ret = {}
+    for main_id, result in matches.items():
+        m = result.match_object
+        base = result.base
+        ids = entries[main_id]['pattern'].get_ids(main_id)
+        for i in range(result.group_count + 1):
+            if m.start(base + i) == -1:
+                continue
+            ret[ids[i]] = {'match': m.group(base + i), 'span': m.span(base + i)}
+    return ret
+
+
+class LazyPatternResults(object):
+    """Mapping like view of the PatternHandler.execute() result of a content,
+    where a pattern is executed only when one of its ids is read for the first
+    time.  Conditions that are not processed do not cost any regexp scan.
+
+    If a statistics dictionary is given, the executions are counted in it keyed
+    with the main ids of the patterns:
+
+    statistics = {
+        <main id>: [<executions>, <matches>, <total execution time in seconds>],
+        ...
+    }
+    """
+    def __init__(self, entries, content, statistics=None):
+        self._entries = entries
+        self._content = content
+        self._statistics = statistics
+        self._results = {}
+
+    def _get_results(self, raw_id):
+        main_id = raw_id.rstrip('0123456789')
+        results = self._results.get(main_id)
+        if results is None:
+            entry = self._entries.get(main_id)
+            if entry is None:
+                results = {}
+            else:
+                statistics = self._statistics
+                if statistics is None:
+                    result = entry['pattern'].match(self._content)
+                else:
+                    start = default_timer()
+                    result = entry['pattern'].match(self._content)
+                    elapsed = default_timer() - start
+                    counters = statistics.setdefault(main_id, [0, 0, 0.0])
+                    counters[0] += 1
+                    counters[1] += 1 if result else 0
+                    counters[2] += elapsed
+                if result:
+                    results = _flatten_matches({main_id: result}, self._entries)
+                else:
+                    results = {}
+            self._results[main_id] = results
+        return results
+
+    def __contains__(self, raw_id):
+        return raw_id in self._get_results(raw_id)
+
+    def __getitem__(self, raw_id):
+        return self._get_results(raw_id)[raw_id]
+
+    def get(self, raw_id, default=None):
+        return self._get_results(raw_id).get(raw_id, default)
+
+
+# Expressions containing group references, conditional groups or global inline
+# flags cannot be embedded into a union, as their meaning depends on their
+# position in the whole expression.  Older Pythons accept global flags anywhere
+# in the expression and apply them to the whole union, so they are looked for
+# everywhere, not only at the start.
+_UNION_UNSAFE_PATTERN = re.compile(r'\\(\d|g<)|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)')
+_BYTES_UNION_UNSAFE_PATTERN = re.compile(_UNION_UNSAFE_PATTERN.pattern.encode('ascii'))
+
+
+class _CombinedEngine(object):
+    """Executes the patterns of a PatternHandler with as few regexp scans as
+    possible.  The patterns are compiled into one alternation where every pattern
+    is wrapped into its own group.  If the union cannot be compiled (for example
+    two patterns use the same group name), the patterns are split into several
+    unions.  Patterns that are unsafe to embed are executed one by one.
+
+    A miss of every union means that none of the patterns could match, so the
+    typical non matching line costs one scan per union.  On a hit the union match
+    is the leftmost match of the first matching pattern, which is exactly what
+    that pattern would find alone.  The other patterns of the union cannot match
+    before the union match, so they are searched from that position.
+    """
+    def __init__(self, patterns):
+        self.size = len(patterns)
+        self.unions = []
+        self.singles = []
+        members = []
+        for position, element in enumerate(patterns):
+            pattern = element['pattern']
+            entry = (position, element['id'], pattern)
+            if pattern.flags or self._is_unsafe(pattern.groups[0]):
+                self.singles.append(entry)
+            else:
+                members.append(entry)
+        if members:
+            self._add_unions(members)
+
+    @staticmethod
+    def _is_unsafe(expression):
+        """Tells if the expression cannot be embedded into a union."""
+        unsafe = _BYTES_UNION_UNSAFE_PATTERN if _is_bytes(expression) else _UNION_UNSAFE_PATTERN
+        return unsafe.search(expression) is not None
+
+    def _add_unions(self, members):
+        """Compiles the members into one union, or splits them in half until the
+        parts can be compiled.
+        """
+        union = self._compile_union(members)
+        if union is not None:
+            self.unions.append(union)
+        elif len(members) == 1:
+            self.singles.extend(members)
+        else:
+            half = len(members) // 2
+            self._add_unions(members[:half])
+            self._add_unions(members[half:])
+
+    @staticmethod
+    def _compile_union(members):
+        if _is_bytes(members[0][2].groups[0]):
+            bar, opening, closing = b'|', b'(', b')'
         else:
-            ret = None
+            bar, opening, closing = '|', '(', ')'
+        try:
+            expression = bar.join(opening + pattern.groups[0] + closing for _, _, pattern in members)
+            compiled = re.compile(expression)
+        except (re.error, TypeError):
+            return None
+        layout = []
+        base = 1
+        for position, main_id, pattern in members:
+            layout.append((position, main_id, pattern.pattern, base, pattern.group_count))
+            base += pattern.group_count + 1
+        return compiled, tuple(layout)
+
+    def match(self, content):
+        results = [None] * self.size
+        for compiled, layout in self.unions:
+            m = compiled.search(content)
+            if m is None:
+                continue
+            start = m.start()
+            for position, main_id, pattern, base, group_count in layout:
+                if m.start(base) != -1:
+                    results[position] = (main_id, MatchResult(m, base, group_count))
+                else:
+                    single = pattern.search(content, start)
+                    if single:
+                        results[position] = (main_id, MatchResult(single, 0, group_count))
+        for position, main_id, pattern in self.singles:
+            result = pattern.match(content)
+            if result:
+                results[position] = (main_id, result)
+
+        ret = {}
+        for result in results:
+            if result:
+                ret[result[0]] = result[1]
         return ret
 
 
@@ -137,9 +910,23 @@ class PatternHandler(object):
     provides an interface for interrogating and modifying the patterns with ids.
 
     Dependency: re
+
+    If combined_engine is set, execute() compiles the patterns into unions and
+    scans every content once per union instead of once per pattern.  The results
+    are the same as the pattern by pattern execution.  The unions are rebuilt
+    after the patterns are modified through the handler.
+
+    The revision is incremented on every pattern modification made through the
+    handler, so the users of the results can tell if their cached results are
+    still valid.
     """
     def __init__(self):
         self.patterns = []
+        self.combined_engine = False
+        self.revision = 0
+        self._engine = None
+        # pattern entries keyed with their main ids
+        self._entries = {}
         # ASCII code of the letter before 'A'. The pattern generation method
         # will increment first this number and assigns the converted one to
         # the newly created condition.
@@ -160,18 +947,19 @@ class PatternHandler(object):
 
     def add_pattern(self):
         """Adds a new empty pattern to the pattern list and returns it's id you can
-        refer to it in the future. If the pattern list reaches the limit (26 patterns)
-        an OverflowError will be raised.
-
-        Raises: OverflowError
+        refer to it in the future.  The ids are A, B, ... Z, then AA, AB and so on.
         """
         self.last_id += 1
-        if self.last_id > ord('Z'):
-            raise OverflowError('Pattern limit has reached..')
-        else:
-            new_entry = {'id': chr(self.last_id), 'pattern': Pattern()}
-            self.patterns.append(new_entry)
-        return chr(self.last_id)
+        main_id = _main_id_for_number(self.last_id - 64)
+        self._append_entry(main_id, Pattern())
+        return main_id
+
+    def _append_entry(self, main_id, pattern):
+        new_entry = {'id': main_id, 'pattern': pattern}
+        self.patterns.append(new_entry)
+        self._entries[main_id] = new_entry
+        self._engine = None
+        self.revision += 1
 
     def remove_pattern(self, raw_id):
         """Removes a pattern specified with the given id. Id validation is happening
@@ -180,16 +968,21 @@ class PatternHandler(object):
         Raises: InvalidPatternIdError
         """
         i = self._get_index_for_id(raw_id)
-        self.patterns.pop(i)
+        entry = self.patterns.pop(i)
+        del self._entries[entry['id']]
+        self._engine = None
+        self.revision += 1
 
-    def modify_pattern(self, raw_id, new_pattern):
-        """Removes a pattern specified with the given id. Id validation is happening
-        here as well.
+    def modify_pattern(self, raw_id, new_pattern, flags=0):
+        """Sets a new expression for the pattern specified with the given id. Id
+        validation is happening here as well.
 
-        Raises: InvalidPatternIdError
+        Raises: InvalidPatternIdError, SyntaxError
         """
         pattern = self._get_pattern_for_id(raw_id)
-        pattern.add_expression(new_pattern)
+        pattern.add_expression(new_pattern, flags)
+        self._engine = None
+        self.revision += 1
 
     def get_parsed_id(self, raw_id):
         """This method uses the two hidden method to provide parsed main id and
@@ -212,21 +1005,33 @@ class PatternHandler(object):
         return tuple(ret)
 
     def get_full_id_list(self, specific_id=None):
-        ret = []
-        for element in self.patterns:
-            g = [element['id']]
-            for i in range(1, len(element['pattern'].groups)):
-                g.append(g[0]+str(i))
-            ret.append(tuple(g))
         if specific_id:
-            i = self._get_index_for_id(specific_id)
-            return ret[i]
-        else:
-            return tuple(ret)
+            parsed_id = self.get_parsed_id(specific_id)
+            return self._get_full_ids(self._entries[parsed_id['main']])
+        return tuple(self._get_full_ids(element) for element in self.patterns)
+
+    @staticmethod
+    def _get_full_ids(element):
+        return element['pattern'].get_ids(element['id'])
+
+    def get_id_for_group_name(self, raw_id, name):
+        """Returns the group id of the named group of the pattern specified with the
+        given id.
+
+        Raises: InvalidPatternIdError
+        """
+        parsed_id = self.get_parsed_id(raw_id)
+        name_ids = self._entries[parsed_id['main']]['pattern'].get_group_name_ids(parsed_id['main'])
+        try:
+            return name_ids[name]
+        except KeyError:
+            raise InvalidPatternIdError('Invalid group name: ' + name)
 
-    def execute(self, content):
+    def execute(self, content, only=None):
         """Executes the search for the given content which has to be an iterable object.
         As a result it returns a dictionary with the keyed with the patters ids.
+        If a collection of main ids is passed as only, the other patterns won't be
+        executed.
 
         returned_dictionary = {
             '<first_pattern_id_whole_pattern>': {'match': '...', 'span': (x, y)},
@@ -249,42 +1054,261 @@ class PatternHandler(object):
             )
         }
         """
+        return _flatten_matches(self.match(content, only), self._entries)
+
+    def match(self, content, only=None):
+        """Lightweight variant of execute().  It returns a dictionary keyed with the
+        main ids of the matching patterns, the values are MatchResult objects that
+        produce the group contents and spans only when they are read.  The only
+        argument works the same way as for execute().
+
+        returned_dictionary_example = {
+            'A': MatchResult(('foo', 'foo'), ((8, 11), (8, 11)))
+        }
+
+        Raises: NoPatternError
+        """
         if not self.patterns:
             raise NoPatternError
+        if only is None:
+            if self.combined_engine:
+                return self._get_engine().match(content)
+            patterns = self.patterns
+        else:
+            patterns = [element for element in self.patterns if element['id'] in only]
         ret = {}
-        for element in self.patterns:
-            current_key = element['id']
-            result = element['pattern'].execute(content)
+        for element in patterns:
+            result = element['pattern'].match(content)
             if result:
-                for i in range(len(result['results'])):
-                    ret[current_key] = {
-                        'match': result['results'][i],
-                        'span': result['spans'][i]
-                    }
-                    current_key = element['id'] + str(i+1)
+                ret[element['id']] = result
+        return ret
+
+    def execute_lazy(self, content, statistics=None):
+        """Demand driven variant of execute().  It returns a LazyPatternResults
+        mapping that executes a pattern only when one of its ids is read, so
+        ConditionHandler.process_lazy() runs only the patterns its processed
+        conditions need, in the order it needs them.  The execution counts,
+        matches and times are collected into the statistics dictionary if it is
+        given.
+        """
+        return LazyPatternResults(self._entries, content, statistics)
+
+    def get_main_ids(self, raw_ids):
+        """Returns the set of main ids for the given pattern and group ids, for
+        example the ConditionHandler.get_required_pattern_ids() result can be
+        translated to the only argument of execute() and match().
+
+        Raises: InvalidPatternIdError
+        """
+        return set(self.get_parsed_id(raw_id)['main'] for raw_id in raw_ids)
+
+    def get_prefilter_stats(self):
+        """Returns the literal prefilter counters of the patterns keyed with their
+        main ids.
+
+        returned_dictionary_example = {
+            'A': {'literals': ('ERROR',), 'hits': 95, 'misses': 5}
+        }
+        """
+        ret = {}
+        for element in self.patterns:
+            pattern = element['pattern']
+            ret[element['id']] = {
+                'literals': pattern.literals,
+                'hits': pattern.prefilter_hits,
+                'misses': pattern.prefilter_misses
+            }
         return ret
 
+    def iter_matches(self, raw_id, content):
+        """Generator that yields a MatchResult for every occurrence of the pattern
+        specified with the given id in the content.
+
+        Raises: InvalidPatternIdError
+        """
+        return self._get_pattern_for_id(raw_id).iter_matches(content)
+
+    def count(self, raw_id, content):
+        """Returns the number of occurrences of the pattern specified with the given
+        id in the content.
+
+        Raises: InvalidPatternIdError
+        """
+        return self._get_pattern_for_id(raw_id).count(content)
+
+    def scan(self, source, chunk_size=DEFAULT_CHUNK_SIZE, encoding='utf-8',
+             errors='replace', only_matches=False, lazy=False):
+        """Generator that executes the patterns on every line of the given source.
+        The source can be a file path or a file object opened in binary or text
+        mode.  The source is read in chunk_size sized blocks, so the memory usage
+        stays flat regardless of the size of the file.
+
+        yielded_tuple = (<line number from 1>, <offset of the line start>, <execute() result>)
+
+        The offset is a byte offset for file paths and binary file objects, and a
+        character offset for text file objects.  If only_matches is set, lines
+        without any pattern match will be skipped.  If lazy is set, the match()
+        results are yielded instead of the execute() results.
+
+        Raises: NoPatternError
+        """
+        if not self.patterns:
+            raise NoPatternError
+        stream, should_close = _open_source(source)
+        try:
+            execute = self.match if lazy else self.execute
+            for line_number, offset, line in _iter_lines(stream, chunk_size, encoding, errors):
+                result = execute(line)
+                if result or not only_matches:
+                    yield line_number, offset, result
+        finally:
+            if should_close:
+                stream.close()
+
+    def scan_buffer(self, source, only_matches=False, lazy=False):
+        """Generator that executes bytes patterns on every line of a bytes buffer
+        without decoding it.  The source can be a file path, which will be memory
+        mapped, or a bytes, bytearray, mmap or memoryview object.  The lines are
+        passed to the patterns as zero copy memoryview slices, the contents are
+        bytes and the spans are byte offsets relative to the line start.
+
+        yielded_tuple = (<line number from 1>, <byte offset of the line start>, <result>)
+
+        The result is in the execute() format, or in the match() format if lazy is
+        set.  The MatchResult.text() method decodes the captured contents when
+        they are needed.  If only_matches is set, lines without any pattern match
+        will be skipped.
+
+        Raises: NoPatternError
+        """
+        if not self.patterns:
+            raise NoPatternError
+        for element in self.patterns:
+            if not element['pattern'].pattern:
+                raise ValueError('Pattern has to be initialized with some value')
+            if not _is_bytes(element['pattern'].groups[0]):
+                raise ValueError('Buffers can only be scanned with bytes patterns: {}'.format(element['id']))
+        buffer, should_close = _open_buffer(source)
+        view = buffer.view if buffer.__class__ is _ViewBuffer else memoryview(buffer)
+        line = ret = result = None
+        try:
+            engine = self._get_engine() if self.combined_engine else None
+            patterns = [(element['id'], element['pattern']) for element in self.patterns]
+            for line_number, start, end in _iter_buffer_lines(buffer):
+                line = view[start:end]
+                if engine:
+                    ret = engine.match(line)
+                else:
+                    ret = {}
+                    for main_id, pattern in patterns:
+                        result = pattern.match_slice(buffer, start, end, line)
+                        if result:
+                            ret[main_id] = result
+                if ret or not only_matches:
+                    yield line_number, start, ret if lazy else _flatten_matches(ret, self._entries)
+        finally:
+            # the slices of the view keep the mapping exported
+            line = ret = result = None
+            del view
+            if should_close:
+                if lazy:
+                    try:
+                        buffer.close()
+                    except BufferError:
+                        # yielded MatchResults referring to the mapped file are
+                        # still alive, the mapping will be released with them
+                        pass
+                else:
+                    buffer.close()
+
+    def scan_parallel(self, path, workers=None, chunk_size=DEFAULT_PARALLEL_CHUNK_SIZE,
+                      encoding='utf-8', errors='replace', only_matches=False):
+        """Parallel variant of scan() for files.  The file is split into chunk_size
+        sized parts at line boundaries, the parts are scanned in a process pool with
+        the given number of workers (all cores by default) and the results are
+        merged back in file order with file wide line numbers.  The yielded tuples
+        are the same as the ones of scan() for the same file.  At most two chunks
+        per worker are in flight, so the memory usage does not grow with the size
+        of the file.
+
+        The workers rebuild the patterns from a picklable snapshot(), so patterns
+        modified after starting the scan won't affect it.
+
+        Raises: NoPatternError
+        """
+        if not self.patterns:
+            raise NoPatternError
+        snapshot = self.snapshot()
+        tasks = [(snapshot, path, start, end, encoding, errors, only_matches)
+                 for start, end in _split_file(path, chunk_size)]
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        pool = None
+        if workers > 1 and len(tasks) > 1:
+            workers = min(workers, len(tasks))
+            pool = multiprocessing.Pool(workers)
+            chunks = _imap_bounded(pool, _scan_file_range, tasks, 2 * workers)
+        else:
+            handlers = {}
+            chunks = (_scan_file_range(task, handlers) for task in tasks)
+        try:
+            base = 0
+            for line_count, results in chunks:
+                for line_number, offset, result in results:
+                    yield base + line_number, offset, result
+                base += line_count
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def snapshot(self):
+        """Returns a hashable and picklable description of the patterns that
+        from_snapshot() can restore the handler from.
+
+        returned_tuple = (<combined engine flag>, <last id>, ((<id>, <expression>, <flags>), ...))
+        """
+        entries = []
+        for element in self.patterns:
+            pattern = element['pattern']
+            expression = pattern.groups[0] if pattern.pattern else None
+            entries.append((element['id'], expression, pattern.flags))
+        return bool(self.combined_engine), self.last_id, tuple(entries)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Creates a new PatternHandler with the patterns of the given snapshot."""
+        combined_engine, last_id, entries = snapshot
+        handler = cls()
+        handler.combined_engine = combined_engine
+        handler.last_id = last_id
+        for main_id, expression, flags in entries:
+            pattern = Pattern()
+            if expression is not None:
+                pattern.add_expression(expression, flags)
+            handler._append_entry(main_id, pattern)
+        return handler
+
+    def _get_engine(self):
+        if self._engine is None:
+            for element in self.patterns:
+                if not element['pattern'].pattern:
+                    raise ValueError('Pattern has to be initialized with some value')
+            self._engine = _CombinedEngine(self.patterns)
+        return self._engine
+
     def _get_pattern_for_id(self, raw_id):
         parsed_id = self.get_parsed_id(raw_id)
-        for element in self.patterns:
-            if element['id'] == parsed_id['main']:
-                return element['pattern']
+        return self._entries[parsed_id['main']]['pattern']
 
     def _get_index_for_id(self, raw_id):
         parsed_id = self.get_parsed_id(raw_id)
-        for i in range(len(self.patterns)):
-            if self.patterns[i]['id'] == parsed_id['main']:
-                return i
+        return self.patterns.index(self._entries[parsed_id['main']])
 
     def _validate_id(self, parsed_id):
-        """Validates the provided indexes.  If the validation fails, an IndexError
-        exception will raised.
+        """Validates the provided indexes.  If the validation fails, an
+        InvalidPatternIdError exception will raised.
         """
-        for entry in self.patterns:
-            if entry['id'] == parsed_id['main']:
-                if parsed_id['group'] < len(entry['pattern'].groups):
-                    break
-                else:
-                    raise InvalidPatternIdError()
-        else:
+        entry = self._entries.get(parsed_id['main'])
+        if entry is None or parsed_id['group'] > entry['pattern'].group_count:
             raise InvalidPatternIdError()
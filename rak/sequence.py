@@ -1,4 +1,7 @@
 import re
+import sys
+from array import array
+from bisect import bisect_left
 
 
 class SequenceNode(object):
@@ -37,12 +40,283 @@ class SequenceNode(object):
             self.proxy_counter += 1
 
 
+def build_line_index(results, condition_ids=None, first_line=0):
+    """Collects the line numbers where the conditions are true from the given
+    iterable of per line condition results, for the offline sequence search.  If
+    condition_ids is given, only those conditions are collected.  The lines are
+    numbered from first_line.
+
+    returned_dictionary = {
+        <condition id>: array('q', [<line number>, ...]),
+        ...
+    }
+    """
+    index = {}
+    if condition_ids is not None:
+        for condition_id in condition_ids:
+            index[condition_id] = array('q')
+    line_number = first_line
+    for data in results:
+        for condition_id, result in data.items():
+            if result:
+                lines = index.get(condition_id)
+                if lines is None:
+                    if condition_ids is not None:
+                        continue
+                    lines = index[condition_id] = array('q')
+                lines.append(line_number)
+        line_number += 1
+    return index
+
+
+# Default limit of the sequence instances waiting at the same time.
+DEFAULT_MAX_INSTANCES = 10000
+
+
+class _SequenceInstance(object):
+    """Record of a partially matched sequence: the index of the waiting step, the
+    match lines of the previous steps and the timestamp of the last match."""
+    __slots__ = ('index', 'lines', 'time')
+
+    def __init__(self):
+        self.index = 0
+        self.lines = []
+        self.time = None
+
+
+class SequenceMachine(object):
+    """Streaming state machine compiled from a linked chain of SequenceNode
+    objects.  It is fed with the condition results of the lines one by one, in
+    the ConditionHandler.process() format, and it emits a match when every
+    node of the chain matched in order with the right offsets.
+
+    The chain is compiled into a tuple of (condition id, offset) steps starting
+    from the trigger node.  The offset of a step is the line distance from the
+    match of the previous step, it is checked from the same line, so a line can
+    satisfy several steps and '==1' means the next line.  A line completes a step
+    if the condition of the step is true for it and the offset accepts the
+    distance on a match.
+
+    Every trigger starts a new sequence instance, so overlapping sequences are
+    matched independently, and every instance advances on the first valid match
+    of its waiting step.  The instances are kept in __slots__ records that are
+    recycled, the work per line is proportional to the number of the waiting
+    instances.  An instance is evicted when its offset rejects the distance
+    before a match, as no later line could complete it.  If more than
+    max_instances are waiting, the oldest ones are dropped and counted.
+
+    Time based offsets measure the time between the timestamps of the lines.
+    The timestamp is captured by the timestamp_id pattern group, it is read from
+    the pattern results of the line and parsed by the timestamp_parser, see
+    TimestampParser.  It is only parsed for the lines where an instance is
+    waiting or a trigger fires.  The lines without timestamp are skipped by a
+    machine with time based offsets.
+
+    returned_match = {
+        'sequence': <id of the trigger node>,
+        'start': <line number of the trigger>,
+        'end': <line number of the last step>,
+        'lines': (<line number of the match of every step>, ...)
+    }
+
+    Raises: ValueError if the node is not a trigger, or a node has no condition,
+            or the timestamp is not configured for time based offsets
+    """
+    def __init__(self, trigger, max_instances=DEFAULT_MAX_INSTANCES,
+                 timestamp_id=None, timestamp_parser=None):
+        if not trigger.is_trigger():
+            raise ValueError('Sequence machine has to start with a trigger: ' + str(trigger.id))
+        steps = []
+        node = trigger
+        while node is not None:
+            if node.condition_id == 0:
+                raise ValueError('No condition id was specified for sequence: ' + str(node))
+            steps.append((node.condition_id, node.offset))
+            node = node.next_sequence
+        self.sequence_id = trigger.id
+        self.steps = tuple(steps)
+        self.timed = any(offset.unit for condition_id, offset in self.steps[1:])
+        if self.timed and (timestamp_id is None or timestamp_parser is None):
+            raise ValueError('Time based offsets need a timestamp id and parser: ' + str(trigger.id))
+        self.timestamp_id = timestamp_id
+        self.timestamp_parser = timestamp_parser
+        self.max_instances = max_instances
+        self.matches = 0
+        self.evictions = 0
+        self.drops = 0
+        self._instances = []
+        self._free = []
+
+    def reset(self):
+        self._free.extend(self._instances)
+        self._instances = []
+
+    def process(self, line_number, data, patterns=None):
+        """Processes the condition results of the given line and returns the list of
+        the sequences completed on it.  The pattern results of the line are only
+        needed for time based offsets."""
+        ret = []
+        timestamp = None
+        if self.timed:
+            if not self._instances and not data.get(self.steps[0][0]):
+                return ret
+            entry = patterns.get(self.timestamp_id) if patterns else None
+            if entry is None or entry['match'] is None:
+                return ret
+            timestamp = self.timestamp_parser.parse(entry['match'])
+
+        waiting = []
+        for instance in self._instances:
+            if self._advance(instance, line_number, data, ret, timestamp):
+                waiting.append(instance)
+            else:
+                self._free.append(instance)
+
+        if data.get(self.steps[0][0]):
+            instance = self._free.pop() if self._free else _SequenceInstance()
+            instance.index = 1
+            instance.lines[:] = [line_number]
+            instance.time = timestamp
+            if self._advance(instance, line_number, data, ret, timestamp):
+                waiting.append(instance)
+            else:
+                self._free.append(instance)
+
+        excess = len(waiting) - self.max_instances
+        if excess > 0:
+            self.drops += excess
+            self._free.extend(waiting[:excess])
+            del waiting[:excess]
+        self._instances = waiting
+        return ret
+
+    def _advance(self, instance, line_number, data, ret, timestamp):
+        """Advances the instance with the given line, and returns True if it is
+        still waiting."""
+        steps = self.steps
+        lines = instance.lines
+        while instance.index < len(steps):
+            condition_id, offset = steps[instance.index]
+            if offset.unit:
+                distance = timestamp - instance.time
+            else:
+                distance = line_number - lines[-1]
+            if data.get(condition_id) and offset.validate_on_match(distance):
+                instance.index += 1
+                lines.append(line_number)
+                instance.time = timestamp
+            elif offset.validate_before_match(distance):
+                return True
+            else:
+                self.evictions += 1
+                return False
+        self.matches += 1
+        ret.append({
+            'sequence': self.sequence_id,
+            'start': lines[0],
+            'end': lines[-1],
+            'lines': tuple(lines)
+        })
+        return False
+
+    def search(self, index):
+        """Offline variant of run() over a line index made by build_line_index().
+        Every step of every trigger is resolved with a single bisect in the lines
+        of its condition, the first line inside the offset window of the step is
+        the match, the same one the streaming machine advances on.  The cost
+        depends on the number of the triggers and the condition hits, not on the
+        number of the lines.  The matches are the same as the matches of run()
+        without the instance limit, in the same order.  The statistics and the
+        waiting instances of the machine are not changed.
+
+        Raises: ValueError for time based offsets
+        """
+        if self.timed:
+            raise ValueError('Offline search supports line offsets only: ' + str(self.sequence_id))
+        empty = array('q')
+        steps = []
+        for condition_id, offset in self.steps[1:]:
+            lower, upper = offset.window()
+            steps.append((index.get(condition_id, empty), lower, upper))
+        ret = []
+        for start in index.get(self.steps[0][0], empty):
+            lines = [start]
+            for hits, lower, upper in steps:
+                previous = lines[-1]
+                i = bisect_left(hits, previous + lower)
+                if i == len(hits) or (upper is not None and hits[i] > previous + upper):
+                    break
+                lines.append(hits[i])
+            else:
+                ret.append({
+                    'sequence': self.sequence_id,
+                    'start': start,
+                    'end': lines[-1],
+                    'lines': tuple(lines)
+                })
+        ret.sort(key=lambda match: (match['end'], match['start']))
+        return ret
+
+    def run(self, results, first_line=0, pattern_results=None):
+        """Generator over the completed sequences of the given iterable of per line
+        condition results.  The lines are numbered from first_line.  The per line
+        pattern results are needed for time based offsets."""
+        line_number = first_line
+        if pattern_results is None:
+            for data in results:
+                for match in self.process(line_number, data):
+                    yield match
+                line_number += 1
+        else:
+            for data, patterns in zip(results, pattern_results):
+                for match in self.process(line_number, data, patterns):
+                    yield match
+                line_number += 1
+
+    def info(self):
+        """Returns the statistics of the machine.
+
+        returned_dictionary = {
+            'waiting': <number of the waiting instances>,
+            'max_instances': <limit of the waiting instances>,
+            'matches': <number of the completed sequences>,
+            'evictions': <number of the instances that ran out of their offset>,
+            'drops': <number of the instances dropped over the limit>
+        }
+        """
+        return {
+            'waiting': len(self._instances),
+            'max_instances': self.max_instances,
+            'matches': self.matches,
+            'evictions': self.evictions,
+            'drops': self.drops
+        }
+
+
 class SequenceState(object):
     """Enumeration object for the internal sequence states"""
     idle = 1
     proxy = 2
 
 
+# Grammar of the offset specifiers, the single value modes and the intervals
+# are alternatives of the same expression.
+_OFFSET_GRAMMAR = re.compile(
+    r'^\s*(?:\$?\s*(?P<operator>==|<=|>=|<|>)?\s*(?P<target>\d+)\s*(?P<unit>ns|us|ms|s|m|h)?'
+    r'|(?P<lower>\d+)\s*(?P<lower_unit>ns|us|ms|s|m|h)?\s*(?P<lower_operator><=|<)\s*\$\s*'
+    r'(?P<upper_operator><=|<)\s*(?P<upper>\d+)\s*(?P<upper_unit>ns|us|ms|s|m|h)?)\s*$')
+
+# Nanoseconds in the time units of the time based offsets.
+TIME_UNITS = {
+    'ns': 1,
+    'us': 1000,
+    'ms': 1000 * 1000,
+    's': 1000 * 1000 * 1000,
+    'm': 60 * 1000 * 1000 * 1000,
+    'h': 60 * 60 * 1000 * 1000 * 1000
+}
+
+
 class Offset(object):
     """Offset is the responsible about validating the distance/offset between
     sequence nodes.  It can verify that a match occurs in the right offset.
@@ -105,86 +379,144 @@ class Offset(object):
              {value}<=$<={value}
              regexp: '^\s*(\d+)\s*<=\s*\$\s*<=\s*(\d+)\s*$'
 
+    Time based offsets
+        The values can have a time unit [ns, us, ms, s, m, h], for example '<500ms'
+        or '1s<=$<=2s'.  The offset is then the time between the timestamps of the
+        lines instead of the line distance, and every limit is compared in epoch
+        nanoseconds.  If the two limits of an interval have different units, both
+        are converted to the finer one, a unit given only for one limit applies to
+        both of them.  The unit is None for line offsets.
+
     Raises:
         ValueError at parsing if impossible interval configuration was added.
         SyntaxError at parsing error
     """
     def __init__(self):
-        self.target_number = 0
-        self.upper_target_number = 0
-        self.mode = OffsetMode.equal
+        self._target_number = 0
+        self._upper_target_number = 0
+        self._mode = OffsetMode.equal
+        self._unit = None
+        self._window = None
+
+    @property
+    def target_number(self):
+        return self._target_number
+
+    @target_number.setter
+    def target_number(self, value):
+        self._target_number = value
+        self._window = None
+
+    @property
+    def upper_target_number(self):
+        return self._upper_target_number
+
+    @upper_target_number.setter
+    def upper_target_number(self, value):
+        self._upper_target_number = value
+        self._window = None
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, value):
+        self._mode = value
+        self._window = None
+
+    @property
+    def unit(self):
+        return self._unit
+
+    @unit.setter
+    def unit(self, value):
+        self._unit = value
+        self._window = None
 
     def validate_before_match(self, offset):
-        return self._validate(offset, False)
+        window = self._window or self._compile_window()
+        return 0 <= offset < window[2]
 
     def validate_on_match(self, offset):
-        return self._validate(offset, True)
+        window = self._window or self._compile_window()
+        return window[0] <= offset <= window[1]
 
     def _validate(self, offset, match):
-        if offset < 0:
-            return False
-
-        if self.mode is OffsetMode.equal:
-            offset_smaller_before__match = not match and offset < self.target_number
-            match_on_target = offset == self.target_number and match
-            return match_on_target or offset_smaller_before__match
-
-        if self.mode is OffsetMode.less_than:
-            return offset < self.target_number
-
-        if self.mode is OffsetMode.less_than_or_equal:
-            return offset <= self.target_number
-
-        if self.mode is OffsetMode.greater_then:
-            return offset > self.target_number or not match
-
-        if self.mode is OffsetMode.greater_then_or_equal:
-            return offset >= self.target_number or not match
-
-        if self.mode >= OffsetMode.interval:
+        if match:
+            return self.validate_on_match(offset)
+        return self.validate_before_match(offset)
+
+    def window(self):
+        """Returns the inclusive range of the offsets validate_on_match() accepts.
+        The upper limit is None if the range is unbounded.  validate_before_match()
+        accepts every offset below the upper limit, so a match at any offset of
+        the window is reachable.
+
+        Raises: ValueError for impossible intervals
+        """
+        lower, upper, alive = self._window or self._compile_window()
+        return lower, None if upper == sys.maxsize else upper
+
+    def _compile_window(self):
+        """Reduces the configuration to a (lower, upper, alive) integer triplet that
+        is cached until the configuration changes.  A match is accepted in the
+        [lower, upper] range, and a sequence can wait for a match at the offsets
+        below alive.  The unbounded limits are sys.maxsize.  The limits of time
+        based offsets are in nanoseconds.
+        """
+        scale = TIME_UNITS[self._unit] if self._unit else 1
+        t = self._target_number * scale
+        mode = self._mode
+        unbounded = sys.maxsize
+        if mode == OffsetMode.equal:
+            window = (t, t, t)
+        elif mode == OffsetMode.less_than:
+            window = (0, t - 1, t)
+        elif mode == OffsetMode.less_than_or_equal:
+            window = (0, t, t + 1)
+        elif mode == OffsetMode.greater_then:
+            window = (t + 1, unbounded, unbounded)
+        elif mode == OffsetMode.greater_then_or_equal:
+            window = (t, unbounded, unbounded)
+        else:
             if not self._validate_interval_limits():
                 raise ValueError('Offset lower limit should be lower!')
-
-            if self.mode is OffsetMode.interval:
-                is_over = offset+1 >= self.upper_target_number
-                is_inside = self.target_number < offset < self.upper_target_number
-                return (is_inside and match) or (not match and not is_over)
-
-            if self.mode is OffsetMode.interval_lower_may_equal:
-                is_over = offset+1 >= self.upper_target_number
-                is_inside = self.target_number <= offset < self.upper_target_number
-                return (is_inside and match) or (not match and not is_over)
-
-            if self.mode is OffsetMode.interval_upper_may_equal:
-                is_over = offset >= self.upper_target_number
-                is_inside = self.target_number < offset <= self.upper_target_number
-                return (is_inside and match) or (not match and not is_over)
-
-            if self.mode is OffsetMode.interval_both_may_equal:
-                is_over = offset >= self.upper_target_number
-                is_inside = self.target_number <= offset <= self.upper_target_number
-                return (is_inside and match) or (not match and not is_over)
+            upper = self._upper_target_number * scale
+            if mode == OffsetMode.interval:
+                window = (t + 1, upper - 1, upper - 1)
+            elif mode == OffsetMode.interval_lower_may_equal:
+                window = (t, upper - 1, upper - 1)
+            elif mode == OffsetMode.interval_upper_may_equal:
+                window = (t + 1, upper, upper)
+            else:
+                window = (t, upper, upper)
+        self._window = (max(window[0], 0),) + window[1:]
+        return self._window
 
     def _validate_interval_limits(self):
         if self.mode >= OffsetMode.interval:
-            if self.target_number > self.upper_target_number:
+            scale = TIME_UNITS[self._unit] if self._unit else 1
+            target_number = self.target_number * scale
+            upper_target_number = self.upper_target_number * scale
+            if target_number > upper_target_number:
                 return False
             if self.mode is OffsetMode.interval:
-                if self.target_number == self.upper_target_number:
+                if target_number == upper_target_number:
                     return False
-                elif self.target_number+1 == self.upper_target_number:
+                elif target_number+1 == upper_target_number:
                     return False
                 else:
                     return True
 
             if self.mode is OffsetMode.interval_lower_may_equal:
-                if self.target_number == self.upper_target_number:
+                if target_number == upper_target_number:
                     return False
                 else:
                     return True
 
             if self.mode is OffsetMode.interval_upper_may_equal:
-                if self.target_number == self.upper_target_number:
+                if target_number == upper_target_number:
                     return False
                 else:
                     return True
@@ -195,73 +527,32 @@ class Offset(object):
             return True
 
     def parse(self, raw_offset):
-        equal_match = re.compile('^\s*\$?\s*(==)?\s*(\d+)\s*$').match(raw_offset)
-        less_than_match = re.compile('^\s*\$?\s*<\s*(\d+)\s*$').match(raw_offset)
-        less_than_or_e_m = re.compile('^\s*\$?\s*<=\s*(\d+)\s*$').match(raw_offset)
-        greater_than_match = re.compile('^\s*\$?\s*>\s*(\d+)\s*$').match(raw_offset)
-        greater_than_o_e_m = re.compile('^\s*\$?\s*>=\s*(\d+)\s*$').match(raw_offset)
-        interval_m = re.compile('^\s*(\d+)\s*<\s*\$\s*<\s*(\d+)\s*$').match(raw_offset)
-        interval_l_m = re.compile('^\s*(\d+)\s*<=\s*\$\s*<\s*(\d+)\s*$').match(raw_offset)
-        interval_u_m = re.compile('^\s*(\d+)\s*<\s*\$\s*<=\s*(\d+)\s*$').match(raw_offset)
-        interval_b_m = re.compile('^\s*(\d+)\s*<=\s*\$\s*<=\s*(\d+)\s*$').match(raw_offset)
-
-        something_matched = False
-
-        if equal_match:
-            self.target_number = int(equal_match.group(2))
-            self.mode = OffsetMode.equal
-            something_matched |= True
-
-        if less_than_match:
-            self.target_number = int(less_than_match.group(1))
-            self.mode = OffsetMode.less_than
-            something_matched |= True
-
-        if less_than_or_e_m:
-            self.target_number = int(less_than_or_e_m.group(1))
-            self.mode = OffsetMode.less_than_or_equal
-            something_matched |= True
-
-        if greater_than_match:
-            self.target_number = int(greater_than_match.group(1))
-            self.mode = OffsetMode.greater_then
-            something_matched |= True
-
-        if greater_than_o_e_m:
-            self.target_number = int(greater_than_o_e_m.group(1))
-            self.mode = OffsetMode.greater_then_or_equal
-            something_matched |= True
-
-        if interval_m:
-            self.target_number = int(interval_m.group(1))
-            self.upper_target_number = int(interval_m.group(2))
-            self.mode = OffsetMode.interval
-            something_matched |= True
-
-        if interval_u_m:
-            self.target_number = int(interval_u_m.group(1))
-            self.upper_target_number = int(interval_u_m.group(2))
-            self.mode = OffsetMode.interval_upper_may_equal
-            something_matched |= True
-
-        if interval_l_m:
-            self.target_number = int(interval_l_m.group(1))
-            self.upper_target_number = int(interval_l_m.group(2))
-            self.mode = OffsetMode.interval_lower_may_equal
-            something_matched |= True
-
-        if interval_b_m:
-            self.target_number = int(interval_b_m.group(1))
-            self.upper_target_number = int(interval_b_m.group(2))
-            self.mode = OffsetMode.interval_both_may_equal
-            something_matched |= True
+        m = _OFFSET_GRAMMAR.match(raw_offset)
+        if not m:
+            raise SyntaxError('Invalid offset specifier: ' + raw_offset)
+
+        if m.group('target') is not None:
+            self.target_number = int(m.group('target'))
+            self.unit = m.group('unit')
+            self.mode = _SINGLE_OFFSET_MODES[m.group('operator')]
+        else:
+            lower = int(m.group('lower'))
+            upper = int(m.group('upper'))
+            lower_unit = m.group('lower_unit') or m.group('upper_unit')
+            upper_unit = m.group('upper_unit') or lower_unit
+            if lower_unit != upper_unit:
+                unit = min(lower_unit, upper_unit, key=TIME_UNITS.get)
+                lower *= TIME_UNITS[lower_unit] // TIME_UNITS[unit]
+                upper *= TIME_UNITS[upper_unit] // TIME_UNITS[unit]
+                lower_unit = unit
+            self.target_number = lower
+            self.upper_target_number = upper
+            self.unit = lower_unit
+            self.mode = _INTERVAL_OFFSET_MODES[(m.group('lower_operator'), m.group('upper_operator'))]
 
         if not self._validate_interval_limits():
             raise ValueError('Invalid offset interval: ' + raw_offset)
 
-        if not something_matched:
-            raise SyntaxError('Invalid offset specifier: ' + raw_offset)
-
 
 class OffsetMode(object):
     """Enumeration object for the Offset states"""
@@ -275,3 +566,19 @@ class OffsetMode(object):
     interval_upper_may_equal = 8
     interval_both_may_equal = 9
 
+
+_SINGLE_OFFSET_MODES = {
+    None: OffsetMode.equal,
+    '==': OffsetMode.equal,
+    '<': OffsetMode.less_than,
+    '<=': OffsetMode.less_than_or_equal,
+    '>': OffsetMode.greater_then,
+    '>=': OffsetMode.greater_then_or_equal
+}
+
+_INTERVAL_OFFSET_MODES = {
+    ('<', '<'): OffsetMode.interval,
+    ('<=', '<'): OffsetMode.interval_lower_may_equal,
+    ('<', '<='): OffsetMode.interval_upper_may_equal,
+    ('<=', '<='): OffsetMode.interval_both_may_equal
+}
@@ -0,0 +1,147 @@
+import calendar
+import re
+
+_MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+
+# Supported strptime directives: group name, expression and width of the field.
+_DIRECTIVES = {
+    'Y': ('year', '\\d{4}', 4),
+    'm': ('month', '\\d{2}', 2),
+    'b': ('month_name', '|'.join(_MONTHS), 3),
+    'd': ('day', '\\d{2}', 2),
+    'H': ('hour', '\\d{2}', 2),
+    'M': ('minute', '\\d{2}', 2),
+    'S': ('second', '\\d{2}', 2),
+    'f': ('fraction', '\\d{1,9}', None)
+}
+
+# Fields that make up the second prefix of a timestamp.
+_SECOND_FIELDS = ('year', 'month', 'month_name', 'day', 'hour', 'minute', 'second')
+
+# Compiled format specializations keyed with the format.
+_format_cache = {}
+
+
+def _compile_format(timestamp_format):
+    """Compiles the format into a regexp, and finds the second prefix: the part
+    of the format up to the last field of the second.  If every field and
+    literal of the prefix has a fixed width, the length of the prefix is returned
+    with a regexp for the rest of the timestamp, otherwise the length is None.
+
+    Raises: ValueError for unsupported directives
+    """
+    # regexp and width of every field and literal
+    parts = []
+    names = []
+    prefix_size = 0
+    i = 0
+    while i < len(timestamp_format):
+        char = timestamp_format[i]
+        if char == '%' and i + 1 < len(timestamp_format):
+            directive = timestamp_format[i + 1]
+            i += 2
+            if directive == '%':
+                parts.append(('%', 1))
+                continue
+            if directive not in _DIRECTIVES:
+                raise ValueError('Unsupported timestamp directive: %' + directive)
+            name, expression, width = _DIRECTIVES[directive]
+            if name in names:
+                raise ValueError('Repeated timestamp directive: %' + directive)
+            names.append(name)
+            parts.append(('(?P<{}>{})'.format(name, expression), width))
+            if name in _SECOND_FIELDS:
+                prefix_size = len(parts)
+        else:
+            parts.append((re.escape(char), 1))
+            i += 1
+
+    if 'year' not in names or 'day' not in names or \
+            ('month' not in names and 'month_name' not in names):
+        raise ValueError('Timestamp format needs a year, a month and a day: ' + timestamp_format)
+
+    regex = re.compile(''.join(part[0] for part in parts))
+    widths = [part[1] for part in parts[:prefix_size]]
+    if None in widths:
+        return regex, None, None
+    rest = re.compile(''.join(part[0] for part in parts[prefix_size:]))
+    return regex, sum(widths), rest
+
+
+class TimestampParser(object):
+    """Fast parser of the timestamps captured from the lines into epoch
+    nanoseconds, for the time based offsets.  The timestamps are treated as UTC.
+
+    The format uses the strptime directives %Y, %m, %b, %d, %H, %M, %S and %f,
+    where %f has 1 to 9 digits and the numeric fields are zero padded.  The
+    format is compiled once into a specialized regexp and shared by every
+    parser with the same format.  Consecutive lines usually share the part of
+    their timestamps up to the seconds, so the epoch second of the last prefix
+    is reused, and only the fraction is parsed for the lines of the same second.
+    If the prefix has a fixed width, the prefix is compared before any regexp
+    is run.
+
+    Raises: ValueError for unsupported formats and for non matching timestamps
+    """
+    def __init__(self, timestamp_format='%Y-%m-%d %H:%M:%S.%f'):
+        entry = _format_cache.get(timestamp_format)
+        if entry is None:
+            entry = _format_cache[timestamp_format] = _compile_format(timestamp_format)
+        self.format = timestamp_format
+        self._regex, self._prefix_length, self._rest = entry
+        self._has_fraction = 'fraction' in self._regex.groupindex
+        self._second_fields = [name for name in _SECOND_FIELDS if name in self._regex.groupindex]
+        self._last_prefix = None
+        self._last_seconds = 0
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+
+    def parse(self, text):
+        """Returns the timestamp at the beginning of the given text in epoch
+        nanoseconds."""
+        if self._prefix_length is not None:
+            prefix = text[:self._prefix_length]
+            if prefix == self._last_prefix:
+                self.prefix_hits += 1
+                seconds = self._last_seconds
+                if not self._has_fraction:
+                    return seconds * 1000000000
+                m = self._rest.match(text, self._prefix_length)
+                if m is None:
+                    raise ValueError('Invalid timestamp: ' + text)
+                return seconds * 1000000000 + self._get_fraction(m)
+
+        m = self._regex.match(text)
+        if m is None:
+            raise ValueError('Invalid timestamp: ' + text)
+        prefix = text[:max(m.end(name) for name in self._second_fields)]
+        if prefix == self._last_prefix:
+            self.prefix_hits += 1
+            seconds = self._last_seconds
+        else:
+            self.prefix_misses += 1
+            seconds = self._get_seconds(m)
+            self._last_prefix = prefix
+            self._last_seconds = seconds
+        if self._has_fraction:
+            return seconds * 1000000000 + self._get_fraction(m)
+        return seconds * 1000000000
+
+    @staticmethod
+    def _get_seconds(m):
+        fields = m.groupdict()
+        if fields.get('month_name'):
+            month = _MONTHS[fields['month_name']]
+        else:
+            month = int(fields['month'])
+        return calendar.timegm((int(fields['year']), month, int(fields['day']),
+                                int(fields.get('hour') or 0), int(fields.get('minute') or 0),
+                                int(fields.get('second') or 0), 0, 0, 0))
+
+    @staticmethod
+    def _get_fraction(m):
+        fraction = m.group('fraction')
+        return int(fraction) * 10 ** (9 - len(fraction))
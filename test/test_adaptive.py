@@ -0,0 +1,53 @@
+import unittest
+from rak.adaptive import AdaptiveProcessor
+from rak.condition import ConditionHandler
+from rak.pattern import PatternHandler
+
+
+class AdaptiveProcessorTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        self.ph.modify_pattern(self.ph.add_pattern(), '(\\w+)+x')
+        self.ph.modify_pattern(self.ph.add_pattern(), 'ERROR')
+        self.ch = ConditionHandler()
+        self.m1 = self.ch.add_match_condition()
+        self.m2 = self.ch.add_match_condition()
+        self.r1 = self.ch.add_relation_condition()
+        self.ch.get_condition(self.m1).condition_processor.pattern_id = 'A'
+        self.ch.get_condition(self.m2).condition_processor.pattern_id = 'B'
+        self.ch.add_child_for(self.r1, 0, self.m1)
+        self.ch.add_child_for(self.r1, 1, self.m2)
+        self.lines = ['INFO {} aaaaaaaaaaaaaaaaaaaa'.format(i) for i in range(50)]
+        self.lines += ['ERROR abcx', 'INFO abcx', 'ERROR abc']
+        self.processor = AdaptiveProcessor(self.ph, self.ch, [self.r1], reorder_interval=20)
+
+    def test__results_are_the_same_as_process(self):
+        for relation in ['AND', 'OR', 'XOR']:
+            self.ch.get_condition(self.r1).condition_processor.relation = relation
+            for line in self.lines * 2:
+                expected = self.ch.process(self.ph.execute(line))[self.r1]
+                self.assertEqual(expected, self.processor.process(line)[self.r1], line)
+
+    def test__expensive_unselective_pattern_is_moved_back(self):
+        for line in self.lines:
+            self.processor.process(line)
+        self.assertEqual(1, self.processor.info()['swaps'])
+        before = self.processor.info()['patterns']['A']['executions']
+        self.processor.process(self.lines[0])
+        self.assertEqual(before, self.processor.info()['patterns']['A']['executions'])
+
+    def test__info(self):
+        self.processor.process('ERROR abcx')
+        info = self.processor.info()
+        self.assertEqual(1, info['processed'])
+        self.assertEqual(['A', 'B'], sorted(info['patterns'].keys()))
+        self.assertEqual(1, info['patterns']['A']['executions'])
+        self.assertEqual(1.0, info['patterns']['A']['hit_rate'])
+        self.assertTrue(info['patterns']['A']['average_time'] >= 0)
+
+    def test__modifications_reset_the_statistics(self):
+        self.processor.process('ERROR abcx')
+        self.ph.modify_pattern('B', 'WARNING')
+        self.processor.process('INFO')
+        self.assertEqual(1, self.processor.info()['processed'])
+        self.assertEqual(1, self.processor.info()['patterns']['A']['executions'])
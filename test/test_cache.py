@@ -0,0 +1,90 @@
+import unittest
+from rak.cache import LineResultCache
+from rak.condition import ConditionHandler
+from rak.pattern import PatternHandler
+
+
+class LineResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        self.a = self.ph.add_pattern()
+        self.ph.modify_pattern(self.a, 'status (\\d+)')
+        self.ch = ConditionHandler()
+        self.c1 = self.ch.add_compare_condition()
+        self.comparer = self.ch.get_condition(self.c1).condition_processor
+        self.comparer.pattern_id = 'A1'
+        self.comparer.value = '200'
+        self.cache = LineResultCache(self.ph, self.ch, max_size=2, max_line_length=20)
+
+    def test__results_are_the_same_as_the_pipeline(self):
+        for line in ['status 200', 'status 500', 'nothing']:
+            pattern_results = self.ph.execute(line)
+            expected = (pattern_results, self.ch.process(pattern_results))
+            self.assertEqual(expected, self.cache.process(line))
+
+    def test__repeated_lines_are_hits(self):
+        first = self.cache.process('status 200')
+        second = self.cache.process('status 200')
+        self.assertIs(first, second)
+        info = self.cache.info()
+        self.assertEqual(1, info['hits'])
+        self.assertEqual(1, info['misses'])
+        self.assertEqual(0.5, info['hit_rate'])
+        self.assertEqual(1, info['size'])
+        self.assertTrue(info['memory'] > 0)
+
+    def test__least_recently_used_line_is_evicted(self):
+        self.cache.process('status 1')
+        self.cache.process('status 2')
+        self.cache.process('status 1')
+        self.cache.process('status 3')
+        self.assertEqual(['status 1', 'status 3'], list(self.cache.entries))
+
+    def test__memory_follows_the_evictions(self):
+        for i in range(10):
+            self.cache.process('status {}'.format(i))
+        expected = sum(entry[1] for entry in self.cache.entries.values())
+        self.assertEqual(expected, self.cache.info()['memory'])
+        self.cache.resize(0)
+        self.assertEqual(0, self.cache.info()['memory'])
+
+    def test__long_lines_are_not_cached(self):
+        line = 'status 200 ' + 'x' * 20
+        self.assertEqual(True, self.cache.process(line)[1][self.c1])
+        self.assertEqual(True, self.cache.process(line)[1][self.c1])
+        info = self.cache.info()
+        self.assertEqual(2, info['skipped'])
+        self.assertEqual(0, info['size'])
+
+    def test__pattern_modification_invalidates_the_cache(self):
+        self.assertEqual(True, self.cache.process('status 200')[1][self.c1])
+        self.ph.modify_pattern(self.a, 'code (\\d+)')
+        self.assertEqual(False, self.cache.process('status 200')[1][self.c1])
+        self.assertEqual(1, self.cache.info()['invalidations'])
+
+    def test__processor_setting_invalidates_the_cache(self):
+        self.assertEqual(True, self.cache.process('status 200')[1][self.c1])
+        self.comparer.value = '500'
+        self.assertEqual(False, self.cache.process('status 200')[1][self.c1])
+        self.comparer.condition = '<'
+        self.assertEqual(True, self.cache.process('status 200')[1][self.c1])
+
+    def test__new_condition_invalidates_the_cache(self):
+        self.cache.process('status 200')
+        m1 = self.ch.add_match_condition()
+        self.ch.get_condition(m1).condition_processor.pattern_id = 'A'
+        self.assertEqual(True, self.cache.process('status 200')[1][m1])
+
+    def test__zero_max_size_disables_the_caching(self):
+        self.cache.resize(0)
+        self.cache.process('status 200')
+        self.cache.process('status 200')
+        self.assertEqual(0, self.cache.info()['hits'])
+        self.assertEqual(0, self.cache.info()['size'])
+
+    def test__clear(self):
+        self.cache.process('status 200')
+        self.cache.process('status 200')
+        self.cache.clear()
+        info = self.cache.info()
+        self.assertEqual((0, 0, 0, 0), (info['size'], info['hits'], info['misses'], info['memory']))
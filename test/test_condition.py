@@ -317,6 +317,59 @@ class CompareConditionTests(unittest.TestCase):
         result = self.c.process(None, None, data)
         self.assertEqual(result, expected)
 
+    def test__missing_pattern__returns_false(self):
+        data = {'A': {'match': 'hello'}}
+        self.c.pattern_id = 'B'
+        self.c.value = '5'
+        self.c.condition = '!='
+        self.assertFalse(self.c.process(None, None, data))
+
+    def test__comparator_is_rebuilt_after_value_change(self):
+        data = {'A': {'match': '3'}}
+        self.c.pattern_id = 'A'
+        self.c.value = '3'
+        self.assertTrue(self.c.process(None, None, data))
+        self.c.value = '4'
+        self.assertFalse(self.c.process(None, None, data))
+        self.c.condition = '<'
+        self.assertTrue(self.c.process(None, None, data))
+
+    def test__comparator_matches_execute_condition(self):
+        contents = ['3', '03', '0x1f', '1f', '2.5', 'true', 'False', 'hello', '']
+        self.c.pattern_id = 'A'
+        for value in ['3', '31', '2.5', 'True', 'false', 'hello', '0x1f']:
+            for condition in ['==', '!=']:
+                self.c.value = value
+                self.c.condition = condition
+                for content in contents:
+                    expected = Comparer._execute_condition(content, value, condition)
+                    result = self.c.process(None, None, {'A': {'match': content}})
+                    self.assertEqual(expected, result, (content, condition, value))
+
+    def test__numeric_comparator_parses_non_decimal_content(self):
+        self.c.pattern_id = 'A'
+        self.c.value = '30'
+        self.c.condition = '<'
+        self.assertTrue(self.c.process(None, None, {'A': {'match': '1a'}}))
+        self.assertTrue(self.c.process(None, None, {'A': {'match': '2.5'}}))
+
+    def test__uncomparable_content__returns_false(self):
+        self.c.pattern_id = 'A'
+        for value in ['3', 'True', 'hello']:
+            for condition in ['==', '!=', '<', '>=']:
+                self.c.value = value
+                self.c.condition = condition
+                self.assertFalse(self.c.process(None, None, {'A': {'match': None}}))
+        self.c.value = '3'
+        self.c.condition = '<'
+        self.assertFalse(self.c.process(None, None, {'A': {'match': 'hello'}}))
+
+    def test__invalid_condition__raises_error_on_process(self):
+        self.c.pattern_id = 'A'
+        self.c.condition = '=>'
+        with self.assertRaises(AttributeError):
+            self.c.process(None, None, {'A': {'match': '1'}})
+
 
 class ConditionUpdateParsing(unittest.TestCase):
     def setUp(self):
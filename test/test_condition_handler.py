@@ -1,6 +1,15 @@
+import io
+import sys
 import unittest
 from rak.condition import (ConditionHandler, NoConditionError,
-                                 ConditionLoopError)
+                                 ConditionLoopError, collect_hits,
+                                 iter_set_bits, unpack_bits)
+from rak.pattern import PatternHandler
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class ConditionHandlerBasicTests(unittest.TestCase):
@@ -85,11 +94,8 @@ class LoopDetectionTests(unittest.TestCase):
         r1 = self.ch.get_condition(r1_id)
         r2 = self.ch.get_condition(r2_id)
 
-        try:
-            self.ch.add_child_for(r2_id, 1, r1_id)
-            self.ch.add_child_for(r1_id, 0, r2_id)
-        except ConditionLoopError:
-            pass
+        r2.add_child(1, r1)
+        r1.add_child(0, r2)
 
         self.assertEqual(True, r2._loop_protocol(r1))
 
@@ -126,6 +132,94 @@ class LoopDetectionTests(unittest.TestCase):
         with self.assertRaises(ConditionLoopError):
             self.ch.add_child_for(r1_id, 0, r4_id)
 
+    def test__loop_through_the_second_related_condition__is_detected(self):
+        r1_id = self.ch.add_relation_condition()
+        r2_id = self.ch.add_relation_condition()
+        r3_id = self.ch.add_relation_condition()
+
+        self.ch.add_child_for(r2_id, 0, r1_id)
+        self.ch.add_child_for(r3_id, 0, r1_id)
+
+        with self.assertRaises(ConditionLoopError):
+            self.ch.add_child_for(r1_id, 0, r3_id)
+
+    def test__loop_error_reports_the_path(self):
+        r1_id = self.ch.add_relation_condition()
+        r2_id = self.ch.add_relation_condition()
+        r3_id = self.ch.add_relation_condition()
+
+        self.ch.add_child_for(r2_id, 0, r1_id)
+        self.ch.add_child_for(r3_id, 0, r2_id)
+
+        with self.assertRaises(ConditionLoopError) as cm:
+            self.ch.add_child_for(r1_id, 1, r3_id)
+        self.assertEqual([r1_id, r3_id, r2_id, r1_id], cm.exception.path)
+        self.assertIn('{0} -> {1} -> {2} -> {0}'.format(r1_id, r3_id, r2_id),
+                      str(cm.exception))
+
+    def test__self_loop__is_detected(self):
+        r_id = self.ch.add_relation_condition()
+        with self.assertRaises(ConditionLoopError) as cm:
+            self.ch.add_child_for(r_id, 0, r_id)
+        self.assertEqual([r_id, r_id], cm.exception.path)
+
+    def test__refused_link_leaves_the_graph_unchanged(self):
+        r1_id = self.ch.add_relation_condition()
+        r2_id = self.ch.add_relation_condition()
+        self.ch.add_child_for(r2_id, 0, r1_id)
+
+        with self.assertRaises(ConditionLoopError):
+            self.ch.add_child_for(r1_id, 0, r2_id)
+
+        self.assertEqual([None, None], self.ch.get_condition(r1_id).children)
+        self.assertEqual(2, len(self.ch.get_plan()))
+
+    def test__links_against_the_creation_order_are_reordered(self):
+        r1_id = self.ch.add_relation_condition()
+        r2_id = self.ch.add_relation_condition()
+        r3_id = self.ch.add_relation_condition()
+
+        self.ch.add_child_for(r1_id, 0, r2_id)
+        self.ch.add_child_for(r2_id, 0, r3_id)
+
+        with self.assertRaises(ConditionLoopError):
+            self.ch.add_child_for(r3_id, 0, r1_id)
+        plan_ids = [step[0] for step in self.ch.get_plan()]
+        self.assertEqual([r3_id, r2_id, r1_id], plan_ids)
+
+    def test__loop_test_reports_the_loop_of_a_condition(self):
+        r1_id = self.ch.add_relation_condition()
+        r2_id = self.ch.add_relation_condition()
+        r1 = self.ch.get_condition(r1_id)
+        r2 = self.ch.get_condition(r2_id)
+        r1.add_child(0, r2)
+        r2.add_child(1, r1)
+
+        with self.assertRaises(ConditionLoopError) as cm:
+            self.ch.loop_test(r1)
+        self.assertEqual([r1_id, r2_id, r1_id], cm.exception.path)
+
+    def test__large_graphs_built_bottom_up(self):
+        count = 20000
+        ids = [self.ch.add_relation_condition() for i in range(count)]
+        for child_id, parent_id in zip(ids, ids[1:]):
+            self.ch.add_child_for(parent_id, 0, child_id)
+            self.ch.add_child_for(parent_id, 1, ids[0])
+        with self.assertRaises(ConditionLoopError) as cm:
+            self.ch.add_child_for(ids[0], 0, ids[-1])
+        self.assertEqual([ids[0], ids[-1], ids[0]], cm.exception.path)
+
+    def test__large_graphs_built_top_down(self):
+        count = 2000
+        ids = [self.ch.add_relation_condition() for i in range(count)]
+        for parent_id, child_id in zip(ids, ids[1:]):
+            self.ch.add_child_for(parent_id, 0, child_id)
+        with self.assertRaises(ConditionLoopError) as cm:
+            self.ch.add_child_for(ids[-1], 0, ids[0])
+        self.assertEqual(count + 1, len(cm.exception.path))
+        plan_ids = [step[0] for step in self.ch.get_plan()]
+        self.assertEqual(ids[::-1], plan_ids)
+
 class ConditionUpdateTests(unittest.TestCase):
     def setUp(self):
         self.ch = ConditionHandler()
@@ -185,3 +279,500 @@ class ProcessConditions(unittest.TestCase):
         result = self.ch.process(data)
 
         self.assertEqual(expected, result)
+
+    def test__unmatched_optional_group_does_not_match(self):
+        ph = PatternHandler()
+        ph.modify_pattern(ph.add_pattern(), '(\\w+)=(?:(\\d+)|x)')
+
+        c1_id = self.ch.add_match_condition()
+        c1 = self.ch.get_condition(c1_id)
+        c1.condition_processor.pattern_id = 'A2'
+
+        c2_id = self.ch.add_compare_condition()
+        c2 = self.ch.get_condition(c2_id)
+        c2.condition_processor.pattern_id = 'A2'
+        c2.condition_processor.condition = '>'
+        c2.condition_processor.value = '3'
+
+        self.assertEqual({1: False, 2: False}, self.ch.process(ph.execute('key=x')))
+        self.assertEqual({1: True, 2: True}, self.ch.process(ph.execute('key=42')))
+
+
+class EvaluationPlanTests(unittest.TestCase):
+    def setUp(self):
+        self.ch = ConditionHandler()
+        self.rel_id = self.ch.add_relation_condition()
+        self.t1_id = self.ch.add_match_condition()
+        self.t2_id = self.ch.add_compare_condition()
+        self.ch.add_child_for(self.rel_id, 0, self.t1_id)
+        self.ch.add_child_for(self.rel_id, 1, self.t2_id)
+        self.ch.get_condition(self.t1_id).condition_processor.pattern_id = 'A'
+        t2 = self.ch.get_condition(self.t2_id).condition_processor
+        t2.pattern_id = 'A1'
+        t2.value = '5'
+        t2.condition = '<'
+
+    def test__children_come_before_their_parents(self):
+        plan = self.ch.get_plan()
+        self.assertEqual([self.t1_id, self.t2_id, self.rel_id], [step[0] for step in plan])
+        self.assertEqual((self.t1_id, self.t2_id, ()), plan[2][3:])
+
+    def test__plan_is_compiled_once(self):
+        plan = self.ch.get_plan()
+        self.ch.process({'A': {'match': 'x'}, 'A1': {'match': '3'}})
+        self.assertIs(plan, self.ch.get_plan())
+
+    def test__plan_is_invalidated_by_adding_conditions(self):
+        plan = self.ch.get_plan()
+        new_id = self.ch.add_match_condition()
+        self.assertIsNot(plan, self.ch.get_plan())
+        self.assertIn(new_id, [step[0] for step in self.ch.get_plan()])
+
+    def test__plan_is_invalidated_by_linking_conditions(self):
+        plan = self.ch.get_plan()
+        self.ch.add_child_for(self.rel_id, 1, self.t1_id)
+        self.assertIsNot(plan, self.ch.get_plan())
+        self.assertEqual((self.t1_id, self.t1_id, ()), self.ch.get_plan()[2][3:])
+
+    def test__relations_are_processed_with_the_results_of_their_children(self):
+        data = {'A': {'match': 'x'}, 'A1': {'match': '3'}}
+        expected = {self.rel_id: True, self.t1_id: True, self.t2_id: True}
+        self.assertEqual(expected, self.ch.process(data))
+
+        data = {'A': {'match': 'x'}, 'A1': {'match': '7'}}
+        expected = {self.rel_id: False, self.t1_id: True, self.t2_id: False}
+        self.assertEqual(expected, self.ch.process(data))
+
+
+class CompiledConditionsTests(unittest.TestCase):
+    def setUp(self):
+        self.ch = ConditionHandler()
+        self.m1 = self.ch.add_match_condition()
+        self.m2 = self.ch.add_match_condition()
+        self.c1 = self.ch.add_compare_condition()
+        self.r1 = self.ch.add_relation_condition()
+        self.r2 = self.ch.add_relation_condition()
+        self.r3 = self.ch.add_relation_condition()
+        self.ch.get_condition(self.m1).condition_processor.pattern_id = 'A'
+        self.ch.get_condition(self.m2).condition_processor.pattern_id = 'B'
+        self.ch.get_condition(self.m2).condition_processor.is_inverted = True
+        comparer = self.ch.get_condition(self.c1).condition_processor
+        comparer.pattern_id = 'A1'
+        comparer.condition = '>='
+        comparer.value = '10'
+        self.ch.get_condition(self.r1).condition_processor.relation = 'AND'
+        self.ch.get_condition(self.r2).condition_processor.relation = 'XOR'
+        self.ch.get_condition(self.r3).condition_processor.relation = 'OR'
+        self.ch.add_child_for(self.r1, 0, self.m1)
+        self.ch.add_child_for(self.r1, 1, self.c1)
+        self.ch.add_child_for(self.r2, 0, self.r1)
+        self.ch.add_child_for(self.r2, 1, self.m2)
+        self.ch.add_child_for(self.r3, 0, self.r2)
+        self.ch.add_child_for(self.r3, 1, self.m1)
+
+    def test__compiled_function_returns_the_same_as_process(self):
+        function = self.ch.compile()
+        for data in [
+            {'A': {'match': 'x'}, 'A1': {'match': '12'}},
+            {'A': {'match': 'x'}, 'A1': {'match': '7'}, 'B': {'match': 'y'}},
+            {'A': {'match': 'x'}, 'A1': {'match': '0x10'}, 'B': {'match': 'y'}},
+            {'A': {'match': 'x'}, 'A1': {'match': '10.5'}}
+        ]:
+            self.assertEqual(self.ch.process(data), function(data))
+
+    def test__generated_source_is_a_straight_assignment_list(self):
+        source = self.ch.compile().source
+        self.assertIn("c_1 = 'A' in data", source)
+        self.assertIn("c_2 = 'B' not in data", source)
+        self.assertIn("c_4 = c_1 and c_3", source)
+        self.assertIn("c_5 = (c_4 or c_2) and not (c_4 and c_2)", source)
+        self.assertIn("c_6 = c_5 or c_1", source)
+
+    def test__explain_prints_the_generated_source(self):
+        output = io.StringIO()
+        original = sys.stdout
+        sys.stdout = output
+        try:
+            function = self.ch.compile(explain=True)
+        finally:
+            sys.stdout = original
+        self.assertEqual(function.source + '\n', output.getvalue())
+
+    def test__invalid_configuration_raises_error_at_compile_time(self):
+        self.ch.get_condition(self.r3).condition_processor.relation = 'NAND'
+        with self.assertRaises(AttributeError):
+            self.ch.compile()
+
+    def test__relation_without_children_raises_error_at_compile_time(self):
+        self.ch.add_relation_condition()
+        with self.assertRaises(AttributeError):
+            self.ch.compile()
+
+
+class LazyProcessingTests(unittest.TestCase):
+    def setUp(self):
+        self.ch = ConditionHandler()
+        self.m1 = self.ch.add_match_condition()
+        self.m2 = self.ch.add_match_condition()
+        self.c1 = self.ch.add_compare_condition()
+        self.r1 = self.ch.add_relation_condition()
+        self.r2 = self.ch.add_relation_condition()
+        self.ch.get_condition(self.m1).condition_processor.pattern_id = 'A'
+        self.ch.get_condition(self.m2).condition_processor.pattern_id = 'B'
+        comparer = self.ch.get_condition(self.c1).condition_processor
+        comparer.pattern_id = 'A1'
+        comparer.value = '3'
+        self.ch.add_child_for(self.r1, 0, self.m1)
+        self.ch.add_child_for(self.r1, 1, self.c1)
+        self.ch.add_child_for(self.r2, 0, self.m2)
+        self.ch.add_child_for(self.r2, 1, self.r1)
+
+    def test__and_skips_the_second_child_if_the_first_is_false(self):
+        # the comparer is not processed at all
+        result = self.ch.process_lazy({}, [self.r1])
+        self.assertEqual({self.m1: False, self.r1: False}, result)
+
+    def test__or_skips_the_second_child_if_the_first_is_true(self):
+        self.ch.get_condition(self.r2).condition_processor.relation = 'OR'
+        result = self.ch.process_lazy({'B': {'match': 'x'}}, [self.r2])
+        self.assertEqual({self.m2: True, self.r2: True}, result)
+
+    def test__xor_evaluates_both_children(self):
+        self.ch.get_condition(self.r2).condition_processor.relation = 'XOR'
+        data = {'A': {'match': 'x'}, 'A1': {'match': '3'}}
+        result = self.ch.process_lazy(data, [self.r2])
+        expected = {self.m1: True, self.m2: False, self.c1: True, self.r1: True, self.r2: True}
+        self.assertEqual(expected, result)
+
+    def test__results_are_the_same_as_process_for_the_roots(self):
+        data = {'A': {'match': 'x'}, 'A1': {'match': '3'}, 'B': {'match': 'y'}}
+        expected = self.ch.process(data)
+        result = self.ch.process_lazy(data, [self.r2, self.m1])
+        for condition_id, value in result.items():
+            self.assertEqual(expected[condition_id], value)
+
+    def test__deep_graphs_do_not_hit_the_recursion_limit(self):
+        ch = ConditionHandler()
+        previous = ch.add_match_condition()
+        ch.get_condition(previous).condition_processor.pattern_id = 'A'
+        leaf = previous
+        for i in range(3000):
+            r = ch.add_relation_condition()
+            ch.get_condition(r).condition_processor.relation = 'OR'
+            ch.get_condition(r).add_child(0, ch.get_condition(previous))
+            ch.get_condition(r).add_child(1, ch.get_condition(leaf))
+            previous = r
+        self.assertEqual(True, ch.process_lazy({'A': None}, [previous])[previous])
+
+    def test__required_pattern_ids(self):
+        self.assertEqual({'A', 'A1'}, self.ch.get_required_pattern_ids([self.r1]))
+        self.assertEqual({'A', 'A1', 'B'}, self.ch.get_required_pattern_ids([self.r2]))
+        self.assertEqual({'B'}, self.ch.get_required_pattern_ids([self.m2]))
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class BatchProcessingTests(unittest.TestCase):
+    def setUp(self):
+        self.ch = ConditionHandler()
+        self.m1 = self.ch.add_match_condition()
+        self.c1 = self.ch.add_compare_condition()
+        self.c2 = self.ch.add_compare_condition()
+        self.r1 = self.ch.add_relation_condition()
+        self.r2 = self.ch.add_relation_condition()
+        self.ch.get_condition(self.m1).condition_processor.pattern_id = 'B'
+        comparer = self.ch.get_condition(self.c1).condition_processor
+        comparer.pattern_id = 'A1'
+        comparer.condition = '>='
+        comparer.value = '10'
+        comparer = self.ch.get_condition(self.c2).condition_processor
+        comparer.pattern_id = 'A2'
+        comparer.value = 'error'
+        self.ch.add_child_for(self.r1, 0, self.c1)
+        self.ch.add_child_for(self.r1, 1, self.c2)
+        self.ch.add_child_for(self.r2, 0, self.r1)
+        self.ch.add_child_for(self.r2, 1, self.m1)
+        self.columns = {
+            'A1': ['12', None, '3', '0x1f', '1.5e2', 'ff'],
+            'A2': ['error', 'error', 'warning', 'error', None, 'error'],
+            'B': [None, 'b', 'b', None, 'b', None]
+        }
+
+    def _process_lines(self):
+        length = len(self.columns['A1'])
+        ret = dict((c.id, []) for c in self.ch.conditions)
+        for i in range(length):
+            data = {}
+            for pattern_id, column in self.columns.items():
+                if column[i] is not None:
+                    data[pattern_id] = {'match': column[i]}
+            for condition_id, result in self.ch.process(data).items():
+                ret[condition_id].append(result)
+        return ret
+
+    def _assert_same_as_process(self):
+        length = len(self.columns['A1'])
+        result = self.ch.process_batch(self.columns, length)
+        for condition_id, expected in self._process_lines().items():
+            self.assertEqual(expected, result[condition_id].tolist(), condition_id)
+
+    def test__batch_is_the_same_as_process(self):
+        self._assert_same_as_process()
+
+    def test__batch_with_every_relation(self):
+        for relation in ['AND', 'OR', 'XOR']:
+            self.ch.get_condition(self.r1).condition_processor.relation = relation
+            self.ch.get_condition(self.r2).condition_processor.relation = relation
+            self._assert_same_as_process()
+
+    def test__batch_with_inverted_matcher_and_string_comparison(self):
+        self.ch.get_condition(self.m1).condition_processor.is_inverted = True
+        self.ch.get_condition(self.c2).condition_processor.condition = '!='
+        self._assert_same_as_process()
+
+    def test__numeric_column_is_converted_in_one_step(self):
+        self.columns['A1'] = ['12', None, '3', '10', '9', '100']
+        result = self.ch.process_batch(self.columns, 6)
+        self.assertEqual([True, False, False, True, False, True], result[self.c1].tolist())
+
+    def test__missing_column_did_not_match(self):
+        del self.columns['B']
+        result = self.ch.process_batch(self.columns, 6)
+        self.assertEqual([False] * 6, result[self.m1].tolist())
+        self._assert_same_as_process()
+
+    def test__results_are_boolean_arrays(self):
+        result = self.ch.process_batch(self.columns, 6)
+        for condition_id in result:
+            self.assertEqual(numpy.bool_, result[condition_id].dtype.type)
+
+    def test__invalid_column_length_raises_error(self):
+        with self.assertRaises(ValueError):
+            self.ch.process_batch(self.columns, 4)
+
+
+class BitsetProcessingTests(unittest.TestCase):
+    def setUp(self):
+        self.ch = ConditionHandler()
+        self.m1 = self.ch.add_match_condition()
+        self.c1 = self.ch.add_compare_condition()
+        self.r1 = self.ch.add_relation_condition()
+        self.ch.get_condition(self.m1).condition_processor.pattern_id = 'B'
+        comparer = self.ch.get_condition(self.c1).condition_processor
+        comparer.pattern_id = 'A1'
+        comparer.condition = '>'
+        comparer.value = '5'
+        self.ch.add_child_for(self.r1, 0, self.c1)
+        self.ch.add_child_for(self.r1, 1, self.m1)
+        self.lines = [
+            {'A': {'match': 'a7'}, 'A1': {'match': '7'}},
+            {},
+            {'A': {'match': 'a2'}, 'A1': {'match': '2'}, 'B': {'match': 'b'}},
+            {'B': {'match': 'b'}},
+            {'A': {'match': 'a9'}, 'A1': {'match': '9'}, 'B': {'match': 'b'}}
+        ]
+
+    def _assert_same_as_process(self):
+        length = len(self.lines)
+        result = self.ch.process_bits(collect_hits(self.lines), length)
+        expected = [self.ch.process(data) for data in self.lines]
+        for condition_id, mask in result.items():
+            self.assertEqual([e[condition_id] for e in expected],
+                             unpack_bits(mask, length), condition_id)
+
+    def test__collect_hits(self):
+        expected = {
+            'A': {0: 'a7', 2: 'a2', 4: 'a9'},
+            'A1': {0: '7', 2: '2', 4: '9'},
+            'B': {2: 'b', 3: 'b', 4: 'b'}
+        }
+        self.assertEqual(expected, collect_hits(self.lines))
+
+    def test__bits_are_the_same_as_process(self):
+        for relation in ['AND', 'OR', 'XOR']:
+            self.ch.get_condition(self.r1).condition_processor.relation = relation
+            self._assert_same_as_process()
+
+    def test__inverted_matcher_is_masked_to_the_block(self):
+        self.ch.get_condition(self.m1).condition_processor.is_inverted = True
+        result = self.ch.process_bits(collect_hits(self.lines), 5)
+        self.assertEqual(0b00011, result[self.m1])
+        self._assert_same_as_process()
+
+    def test__missing_pattern_has_no_hits(self):
+        result = self.ch.process_bits({}, 5)
+        self.assertEqual({self.m1: 0, self.c1: 0, self.r1: 0}, result)
+
+    def test__set_bits_of_a_sparse_mask(self):
+        mask = (1 << 3) | (1 << 100) | (1 << 5000)
+        self.assertEqual([3, 100, 5000], list(iter_set_bits(mask)))
+        self.assertEqual([], list(iter_set_bits(0)))
+
+    def test__unpack_bits(self):
+        self.assertEqual([True, False, True, False], unpack_bits(0b0101, 4))
+
+
+class OperandReorderingTests(unittest.TestCase):
+    def setUp(self):
+        self.ch = ConditionHandler()
+        self.m1 = self.ch.add_match_condition()
+        self.m2 = self.ch.add_match_condition()
+        self.r1 = self.ch.add_relation_condition()
+        self.ch.get_condition(self.m1).condition_processor.pattern_id = 'A1'
+        self.ch.get_condition(self.m2).condition_processor.pattern_id = 'B'
+        self.ch.add_child_for(self.r1, 0, self.m1)
+        self.ch.add_child_for(self.r1, 1, self.m2)
+        self.lines = [{}, {'B': {'match': 'b'}}, {'A1': {'match': 'a'}},
+                      {'A1': {'match': 'a'}, 'B': {'match': 'b'}}]
+
+    def _collect(self, lines):
+        statistics = {}
+        for data in lines:
+            self.ch.process_lazy(data, [self.r1], statistics)
+        return statistics
+
+    def test__statistics_are_collected(self):
+        statistics = self._collect(self.lines)
+        self.assertEqual([4, 2], statistics[self.m1])
+        self.assertEqual([2, 1], statistics[self.m2])
+        self.assertEqual([4, 1], statistics[self.r1])
+
+    def test__cheap_child_is_moved_first(self):
+        statistics = self._collect(self.lines)
+        self.assertEqual(1, self.ch.reorder_operands({'A': 10.0, 'B': 1.0}, statistics))
+        self.assertEqual({self.m2: False, self.r1: False}, self.ch.process_lazy({}, [self.r1]))
+
+    def test__decisive_child_is_moved_first(self):
+        # B is as cheap as A, but false for almost every line
+        statistics = self._collect(self.lines + [{'A1': {'match': 'a'}}] * 10)
+        self.assertEqual(1, self.ch.reorder_operands({'A': 1.0, 'B': 1.0}, statistics))
+
+    def test__hysteresis_keeps_the_order(self):
+        statistics = self._collect(self.lines)
+        self.assertEqual(0, self.ch.reorder_operands({'A': 1.05, 'B': 1.0}, statistics, 0.1))
+        self.assertEqual(1, self.ch.reorder_operands({'A': 1.05, 'B': 1.0}, statistics, 0.0))
+        self.assertEqual(0, self.ch.reorder_operands({'A': 1.0, 'B': 1.05}, statistics, 0.1))
+
+    def test__results_do_not_change(self):
+        expected = [self.ch.process(data)[self.r1] for data in self.lines]
+        for relation in ['AND', 'OR', 'XOR']:
+            self.ch.get_condition(self.r1).condition_processor.relation = relation
+            expected = [self.ch.process(data)[self.r1] for data in self.lines]
+            self.ch.reorder_operands({'A': 10.0, 'B': 1.0}, self._collect(self.lines), 0.0)
+            result = [self.ch.process_lazy(data, [self.r1])[self.r1] for data in self.lines]
+            self.assertEqual(expected, result)
+
+    def test__linking_drops_the_order(self):
+        self.ch.reorder_operands({'A': 10.0, 'B': 1.0}, self._collect(self.lines))
+        self.ch.add_child_for(self.r1, 1, self.m2)
+        self.assertEqual({self.m1: False, self.r1: False}, self.ch.process_lazy({}, [self.r1]))
+
+
+class NaryRelationTests(unittest.TestCase):
+    def setUp(self):
+        self.ch = ConditionHandler()
+        self.pattern_ids = ['A', 'B', 'C', 'D']
+        self.matchers = []
+        for pattern_id in self.pattern_ids:
+            m = self.ch.add_match_condition()
+            self.ch.get_condition(m).condition_processor.pattern_id = pattern_id
+            self.matchers.append(m)
+        self.lines = []
+        for bits in range(16):
+            data = {}
+            for i, pattern_id in enumerate(self.pattern_ids):
+                if bits & (1 << i):
+                    data[pattern_id] = {'match': pattern_id}
+            self.lines.append(data)
+
+    def _add_relation(self, relation, child_ids):
+        r = self.ch.add_relation_condition()
+        self.ch.get_condition(r).condition_processor.relation = relation
+        for index, child_id in enumerate(child_ids):
+            self.ch.add_child_for(r, index, child_id)
+        return r
+
+    def _expected(self, relation, data):
+        values = [pattern_id in data for pattern_id in self.pattern_ids]
+        if relation == 'AND':
+            return all(values)
+        if relation == 'OR':
+            return any(values)
+        return sum(values) % 2 == 1
+
+    def _assert_every_path(self, root):
+        process_conditions = self.ch.compile()
+        expected = [self.ch.process(data) for data in self.lines]
+        self.assertEqual(expected, [process_conditions(data) for data in self.lines])
+        for data, results in zip(self.lines, expected):
+            self.assertEqual(results[root], self.ch.process_lazy(data, [root])[root])
+        bits = self.ch.process_bits(collect_hits(self.lines), len(self.lines))
+        self.assertEqual([e[root] for e in expected], unpack_bits(bits[root], len(self.lines)))
+        if numpy is not None:
+            columns = dict((pattern_id, [data[pattern_id]['match'] if pattern_id in data else None
+                                         for data in self.lines])
+                           for pattern_id in self.pattern_ids)
+            batch = self.ch.process_batch(columns, len(self.lines))
+            self.assertEqual([e[root] for e in expected], batch[root].tolist())
+
+    def test__relation_with_more_children(self):
+        for relation in ['AND', 'OR', 'XOR']:
+            r = self._add_relation(relation, self.matchers)
+            self.assertEqual(4, len(self.ch.get_condition(r).children))
+            for data in self.lines:
+                self.assertEqual(self._expected(relation, data), self.ch.process(data)[r])
+            self._assert_every_path(r)
+
+    def test__child_index_after_the_last_slot_only(self):
+        r = self._add_relation('AND', self.matchers[:2])
+        with self.assertRaises(IndexError):
+            self.ch.add_child_for(r, 3, self.matchers[2])
+
+    def test__nested_relations_are_flattened(self):
+        for relation in ['AND', 'OR', 'XOR']:
+            previous = self._add_relation(relation, self.matchers[:2])
+            for m in self.matchers[2:]:
+                previous = self._add_relation(relation, [previous, m])
+            expected = [self.ch.process(data)[previous] for data in self.lines]
+            self.assertEqual(2, self.ch.normalize())
+            children = [c.id for c in self.ch.get_condition(previous).children]
+            self.assertEqual(self.matchers, children)
+            self.assertEqual(expected, [self.ch.process(data)[previous] for data in self.lines])
+            self._assert_every_path(previous)
+            self.assertEqual(0, self.ch.normalize())
+
+    def test__duplicate_children_are_removed(self):
+        inner = self._add_relation('OR', [self.matchers[0], self.matchers[1]])
+        r = self._add_relation('OR', [self.matchers[0], inner, self.matchers[1]])
+        self.assertEqual(1, self.ch.normalize())
+        children = [c.id for c in self.ch.get_condition(r).children]
+        self.assertEqual(self.matchers[:2], children)
+
+    def test__relation_keeps_two_children(self):
+        r = self._add_relation('AND', [self.matchers[0], self.matchers[0]])
+        self.assertEqual(0, self.ch.normalize())
+        self.assertEqual(2, len(self.ch.get_condition(r).children))
+
+    def test__xor_duplicates_are_kept(self):
+        inner = self._add_relation('XOR', [self.matchers[0], self.matchers[1]])
+        r = self._add_relation('XOR', [self.matchers[0], inner])
+        expected = [self.ch.process(data)[r] for data in self.lines]
+        self.ch.normalize()
+        self.assertEqual(3, len(self.ch.get_condition(r).children))
+        self.assertEqual(expected, [self.ch.process(data)[r] for data in self.lines])
+
+    def test__different_operators_are_not_flattened(self):
+        inner = self._add_relation('OR', self.matchers[:2])
+        r = self._add_relation('AND', [inner, self.matchers[2]])
+        self.assertEqual(0, self.ch.normalize())
+        self.assertEqual([inner, self.matchers[2]],
+                         [c.id for c in self.ch.get_condition(r).children])
+
+    def test__reordering_more_children(self):
+        r = self._add_relation('AND', self.matchers)
+        statistics = {}
+        for data in self.lines:
+            self.ch.process_lazy(data, [r], statistics)
+        costs = {'A': 4.0, 'B': 3.0, 'C': 2.0, 'D': 1.0}
+        self.assertEqual(1, self.ch.reorder_operands(costs, statistics))
+        self.assertEqual({self.matchers[3]: False, r: False}, self.ch.process_lazy({}, [r]))
+        self._assert_every_path(r)
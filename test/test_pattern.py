@@ -1,5 +1,7 @@
+import re
 import unittest
-from rak.pattern import Pattern
+from rak.pattern import (Pattern, MatchResult, clear_pattern_cache, get_pattern_cache_info,
+                         set_pattern_cache_size)
 
 
 class PatternBasicBehaviorTests(unittest.TestCase):
@@ -138,3 +140,256 @@ class PatternRegexpExecutionTests(unittest.TestCase):
         expected = None
         result = self.p.execute(raw_text)
         self.assertEqual(result, expected)
+
+
+class PatternMatchResultTests(unittest.TestCase):
+    def setUp(self):
+        self.p = Pattern()
+
+    def test__empty_pattern__should_raise_exception_on_match(self):
+        with self.assertRaises(ValueError):
+            self.p.match('foo')
+
+    def test__no_match__returns_none(self):
+        self.p.add_expression('(Foo)')
+        self.assertEqual(None, self.p.match('kjkjkj'))
+
+    def test__match_result_reads_groups_from_the_match_object(self):
+        self.p.add_expression('(Foo):(\d+)')
+        result = self.p.match('  Foo:12   kjkjkjkj')
+        self.assertEqual(MatchResult, result.__class__)
+        self.assertEqual(3, len(result))
+        self.assertEqual('Foo:12', result.group())
+        self.assertEqual('12', result.group(2))
+        self.assertEqual((6, 8), result.span(2))
+        self.assertEqual(('Foo:12', 'Foo', '12'), result.results)
+        self.assertEqual(((2, 8), (2, 5), (6, 8)), result.spans)
+
+    def test__match_result_can_be_converted_to_the_execute_format(self):
+        self.p.add_expression('(Foo):(\d+)')
+        result = self.p.match('  Foo:12   kjkjkjkj').as_dict()
+        self.assertEqual(self.p.execute('  Foo:12   kjkjkjkj'), result)
+
+    def test__match_result_has_no_instance_dictionary(self):
+        self.p.add_expression('Foo')
+        result = self.p.match('Foo')
+        with self.assertRaises(AttributeError):
+            result.__dict__
+
+
+class PatternAllOccurrencesTests(unittest.TestCase):
+    def setUp(self):
+        self.p = Pattern()
+
+    def test__empty_pattern__should_raise_exception(self):
+        with self.assertRaises(ValueError):
+            list(self.p.iter_matches('foo'))
+        with self.assertRaises(ValueError):
+            self.p.count('foo')
+
+    def test__every_occurrence_is_yielded(self):
+        self.p.add_expression('(\w+)=(\d+)')
+        result = [r.as_dict() for r in self.p.iter_matches('a=1, bb=22 c=x')]
+        expected = [
+            {'results': ('a=1', 'a', '1'), 'spans': ((0, 3), (0, 1), (2, 3))},
+            {'results': ('bb=22', 'bb', '22'), 'spans': ((5, 10), (5, 7), (8, 10))}
+        ]
+        self.assertEqual(result, expected)
+
+    def test__no_occurrence(self):
+        self.p.add_expression('foo')
+        self.assertEqual([], list(self.p.iter_matches('bar')))
+        self.assertEqual(0, self.p.count('bar'))
+
+    def test__count(self):
+        self.p.add_expression('o')
+        self.assertEqual(4, self.p.count('foo boo'))
+
+
+class PatternLiteralPrefilterTests(unittest.TestCase):
+    def setUp(self):
+        self.p = Pattern()
+
+    def test__default_prefilter_values(self):
+        self.assertEqual((), self.p.literals)
+        self.assertEqual(0, self.p.prefilter_hits)
+        self.assertEqual(0, self.p.prefilter_misses)
+
+    def test__literal_runs_are_collected_longest_first(self):
+        self.p.add_expression('ERROR (\d+) user=(\w+)')
+        self.assertEqual(('ERROR ', ' user='), self.p.literals)
+
+    def test__literals_of_groups_and_mandatory_repeats_are_collected(self):
+        self.p.add_expression('(?:ab)+c(timeout)x{2}')
+        self.assertEqual(('timeout', 'ab', 'c', 'x'), self.p.literals)
+
+    def test__optional_parts_are_not_collected(self):
+        self.p.add_expression('a{0,3}b?(?=foo)(x|y)[yz]')
+        self.assertEqual((), self.p.literals)
+
+    def test__case_insensitive_parts_are_not_collected(self):
+        self.p.add_expression('(?i)foo')
+        self.assertEqual((), self.p.literals)
+        self.p.add_expression('(?i:foo)bar')
+        self.assertEqual(('bar',), self.p.literals)
+
+    def test__text_without_literal_is_rejected_before_the_search(self):
+        self.p.add_expression('ERROR (\d+)')
+        self.assertEqual(None, self.p.match('INFO 42'))
+        self.assertEqual(0, self.p.count('INFO 42'))
+        self.assertEqual([], list(self.p.iter_matches('INFO 42')))
+        self.assertEqual(3, self.p.prefilter_hits)
+        self.assertEqual(0, self.p.prefilter_misses)
+
+    def test__text_with_literals_is_searched(self):
+        self.p.add_expression('ERROR (\d+)')
+        self.assertEqual(None, self.p.match('ERROR x'))
+        self.assertEqual('42', self.p.match('ERROR 42').group(1))
+        self.assertEqual(0, self.p.prefilter_hits)
+        self.assertEqual(2, self.p.prefilter_misses)
+
+    def test__counters_are_reset_by_new_expression(self):
+        self.p.add_expression('foo')
+        self.p.match('bar')
+        self.p.add_expression('bar')
+        self.assertEqual(0, self.p.prefilter_hits)
+
+
+class PatternCacheTests(unittest.TestCase):
+    def setUp(self):
+        clear_pattern_cache()
+
+    def tearDown(self):
+        set_pattern_cache_size(256)
+        clear_pattern_cache()
+
+    def test__identical_expressions_are_compiled_once(self):
+        p1 = Pattern()
+        p2 = Pattern()
+        p1.add_expression('(foo)')
+        p2.add_expression('(foo)')
+        self.assertIs(p1.pattern, p2.pattern)
+        info = get_pattern_cache_info()
+        self.assertEqual(1, info['hits'])
+        self.assertEqual(1, info['misses'])
+        self.assertEqual(1, info['size'])
+        self.assertEqual(0.5, info['hit_rate'])
+
+    def test__flags_are_part_of_the_key(self):
+        p = Pattern()
+        p.add_expression('foo')
+        p.add_expression('foo', re.IGNORECASE)
+        self.assertEqual(2, get_pattern_cache_info()['misses'])
+        self.assertEqual(re.IGNORECASE, p.flags)
+        self.assertEqual((), p.literals)
+        self.assertEqual('FOO', p.match('FOO').group())
+
+    def test__least_recently_used_expression_is_dropped(self):
+        set_pattern_cache_size(2)
+        p = Pattern()
+        p.add_expression('a')
+        p.add_expression('b')
+        p.add_expression('a')
+        p.add_expression('c')
+        p.add_expression('a')
+        p.add_expression('b')
+        info = get_pattern_cache_info()
+        self.assertEqual(2, info['hits'])
+        self.assertEqual(4, info['misses'])
+        self.assertEqual(2, info['size'])
+
+    def test__zero_size_disables_caching(self):
+        set_pattern_cache_size(0)
+        p = Pattern()
+        p.add_expression('a')
+        p.add_expression('a')
+        self.assertEqual(0, get_pattern_cache_info()['size'])
+        self.assertEqual(2, get_pattern_cache_info()['misses'])
+
+    def test__invalid_expression_is_not_cached(self):
+        with self.assertRaises(SyntaxError):
+            Pattern().add_expression('(foo')
+        self.assertEqual(0, get_pattern_cache_info()['size'])
+
+
+class PatternBytesTests(unittest.TestCase):
+    def setUp(self):
+        self.p = Pattern()
+
+    def test__bytes_expression(self):
+        self.p.add_expression(b'(\w+)=(\d+)')
+        self.assertEqual((b'(\w+)=(\d+)', b'(\w+)', b'(\d+)'), self.p.groups)
+        self.assertEqual((b'=',), self.p.literals)
+        result = self.p.execute(b'key=42')
+        self.assertEqual({'results': (b'key=42', b'key', b'42'),
+                          'spans': ((0, 6), (0, 3), (4, 6))}, result)
+
+    def test__invalid_bytes_expression_raises_error(self):
+        with self.assertRaises(SyntaxError):
+            self.p.add_expression(b'(foo')
+
+    def test__captured_content_is_decoded_on_demand(self):
+        self.p.add_expression(b'name=(\S+)')
+        result = self.p.match(u'name=\xe9t\xe9'.encode('utf-8'))
+        self.assertEqual(u'\xe9t\xe9'.encode('utf-8'), result.group(1))
+        self.assertEqual(u'\xe9t\xe9', result.text(1))
+        self.assertEqual((5, 10), result.span(1))
+
+    def test__memoryview_slice_can_be_matched(self):
+        self.p.add_expression(b'^foo')
+        buffer = b'xx\nfoo'
+        result = self.p.match(memoryview(buffer)[3:6])
+        self.assertEqual((0, 3), result.span())
+
+    def test__slice_of_a_buffer_is_prefiltered_on_the_buffer(self):
+        self.p.add_expression(b'^ERROR (\d+)')
+        buffer = b'ERROR 1\nINFO ERROR 2'
+        view = memoryview(buffer)
+        self.assertEqual(None, self.p.match_slice(buffer, 8, 20, view[8:20]))
+        self.assertEqual(None, self.p.match_slice(buffer, 8, 12, view[8:12]))
+        result = self.p.match_slice(buffer, 0, 7, view[0:7])
+        self.assertEqual((6, 7), result.span(1))
+        self.assertEqual(1, self.p.prefilter_hits)
+        self.assertEqual(2, self.p.prefilter_misses)
+
+
+class PatternGroupTableTests(unittest.TestCase):
+    def setUp(self):
+        self.p = Pattern()
+
+    def test__default_group_table(self):
+        self.assertEqual(0, self.p.group_count)
+        self.assertEqual((None,), self.p.group_names)
+        self.assertEqual(('A',), self.p.get_ids('A'))
+
+    def test__nested_groups(self):
+        self.p.add_expression('((a)(b(c)))')
+        self.assertEqual(4, self.p.group_count)
+        self.assertEqual(('((a)(b(c)))', '((a)(b(c)))', '(a)', '(b(c))', '(c)'), self.p.groups)
+
+    def test__non_capturing_groups_and_extensions_are_skipped(self):
+        self.p.add_expression('(?:x)(?=y)(?<!z)(?#c(x)(a)(?P<n>b)(?P=n)(?(1)c|d)')
+        self.assertEqual(2, self.p.group_count)
+        self.assertEqual(('(a)', '(?P<n>b)'), self.p.groups[1:])
+        self.assertEqual((None, None, 'n'), self.p.group_names)
+
+    def test__parentheses_in_character_sets_and_escapes_are_skipped(self):
+        self.p.add_expression(r'[(]\((x)[^)\]]()')
+        self.assertEqual(('(x)', '()'), self.p.groups[1:])
+
+    def test__verbose_comments_are_skipped(self):
+        self.p.add_expression('(a)  # (not a group)\n (b)', re.VERBOSE)
+        self.assertEqual(('(a)', '(b)'), self.p.groups[1:])
+
+    def test__bytes_groups(self):
+        self.p.add_expression(b'(?P<key>\w+)=((\d)+)')
+        self.assertEqual((b'(?P<key>\w+)', b'((\d)+)', b'(\d)'), self.p.groups[1:])
+
+    def test__ids_are_built_from_the_group_count(self):
+        self.p.add_expression('(?P<key>\w+)=(?:(\d)+)')
+        self.assertEqual(('B', 'B1', 'B2'), self.p.get_ids('B'))
+        self.assertEqual({'key': 'B1'}, self.p.get_group_name_ids('B'))
+        self.assertIs(self.p.get_ids('B'), self.p.get_ids('B'))
+        self.assertEqual(('C', 'C1', 'C2'), self.p.get_ids('C'))
+        self.p.add_expression('x')
+        self.assertEqual(('C',), self.p.get_ids('C'))
@@ -1,6 +1,12 @@
+import io
+import os
+import re
+import tempfile
 import unittest
+import rak.pattern
 from rak.pattern import (Pattern, PatternHandler, InvalidPatternIdError, _parse_id,
-                               NoPatternError)
+                               NoPatternError, _CombinedEngine, _worker_handlers,
+                               _imap_bounded)
 
 
 class PatternHandlerAddingPatternsTests(unittest.TestCase):
@@ -31,19 +37,36 @@ class PatternHandlerAddingPatternsTests(unittest.TestCase):
         self.assertEqual(result, expected)
         self.assertEqual(2, len(self.ph.patterns))
 
-    def test__adding_pattern_failed_if_the_last_letter_has_assigned(self):
+    def test__adding_pattern_continues_with_multi_letter_ids_after_the_last_letter(self):
         expected = 'Z'
         result = ''
         for i in range(26):
             result = self.ph.add_pattern()
         self.assertEqual(result, expected)
 
-        with self.assertRaises(OverflowError):
-            self.ph.add_pattern()
+        self.assertEqual('AA', self.ph.add_pattern())
+        self.assertEqual('AB', self.ph.add_pattern())
 
-        max_len = 26
-        l = len(self.ph.patterns)
-        self.assertEqual(max_len, l)
+        for i in range(26 * 27 - 28):
+            result = self.ph.add_pattern()
+        self.assertEqual('ZZ', result)
+        self.assertEqual('AAA', self.ph.add_pattern())
+        self.assertEqual(26 * 27 + 1, len(self.ph.patterns))
+
+    def test__multi_letter_ids_can_be_used(self):
+        for i in range(28):
+            self.ph.add_pattern()
+        self.ph.modify_pattern('AB', '(foo)(bar)')
+        self.assertEqual(('AB', 'AB1', 'AB2'), self.ph.get_full_id_list('AB2'))
+        result = [r.results for r in self.ph.iter_matches('AB1', 'foobar')]
+        self.assertEqual([('foobar', 'foo', 'bar')], result)
+        self.ph.remove_pattern('A')
+        self.assertEqual(27, len(self.ph.patterns))
+        self.assertEqual('AB', self.ph.patterns[26]['id'])
+        with self.assertRaises(InvalidPatternIdError):
+            self.ph.modify_pattern('A', 'foo')
+        with self.assertRaises(InvalidPatternIdError):
+            self.ph.get_parsed_id('AB3')
 
 
 class PatternHandlerPrint(unittest.TestCase):
@@ -105,6 +128,20 @@ class PatternHandlerIdParsingTests(unittest.TestCase):
         with self.assertRaises(InvalidPatternIdError):
             _parse_id(raw_id)
 
+    def test__multi_letter_id_with_group_index(self):
+        raw_id = 'AB12'
+        expected = {'main': 'AB', 'group': 12}
+        result = _parse_id(raw_id)
+        self.assertEqual(result, expected)
+
+    def test__trailing_characters__raises_exception(self):
+        with self.assertRaises(InvalidPatternIdError):
+            _parse_id('A2x')
+
+    def test__parsed_ids_are_not_shared(self):
+        _parse_id('C')['group'] = 5
+        self.assertEqual({'main': 'C', 'group': 0}, _parse_id('C'))
+
     def test__numeric_id__raises_exception(self):
         raw_id = '42'
         with self.assertRaises(InvalidPatternIdError):
@@ -333,3 +370,455 @@ class PatternHandlerExecute(unittest.TestCase):
 
         result = self.ph.execute(content)
         self.assertEqual(result, expected)
+
+
+class PatternHandlerScanTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        main_id = self.ph.add_pattern()
+        self.ph.modify_pattern(main_id, 'foo(\d+)')
+
+    def test__empty_pattern_list_raises_error_on_scan(self):
+        ph = PatternHandler()
+        with self.assertRaises(NoPatternError):
+            list(ph.scan(io.BytesIO(b'foo')))
+
+    def test__scan_binary_stream(self):
+        content = io.BytesIO(b'foo1\nbar\nxfoo23\n')
+        expected = [
+            (1, 0, {'A': {'match': 'foo1', 'span': (0, 4)},
+                    'A1': {'match': '1', 'span': (3, 4)}}),
+            (2, 5, {}),
+            (3, 9, {'A': {'match': 'foo23', 'span': (1, 6)},
+                    'A1': {'match': '23', 'span': (4, 6)}})
+        ]
+        result = list(self.ph.scan(content))
+        self.assertEqual(result, expected)
+
+    def test__scan_lines_across_chunk_boundaries(self):
+        content = b'foo1\r\nbar\nxfoo23'
+        expected = list(self.ph.scan(io.BytesIO(content)))
+        for chunk_size in range(1, 8):
+            result = list(self.ph.scan(io.BytesIO(content), chunk_size=chunk_size))
+            self.assertEqual(result, expected)
+        self.assertEqual([1, 2, 3], [r[0] for r in expected])
+        self.assertEqual([0, 6, 10], [r[1] for r in expected])
+
+    def test__scan_text_stream_reports_character_offsets(self):
+        content = io.StringIO(u'é\nfoo7\n')
+        expected = [
+            (2, 2, {'A': {'match': 'foo7', 'span': (0, 4)},
+                    'A1': {'match': '7', 'span': (3, 4)}})
+        ]
+        result = list(self.ph.scan(content, only_matches=True))
+        self.assertEqual(result, expected)
+
+    def test__scan_file_path(self):
+        handle, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(u'é\nfoo7\n'.encode('utf-8'))
+            result = list(self.ph.scan(path, only_matches=True))
+        finally:
+            os.remove(path)
+        self.assertEqual([(2, 3)], [r[:2] for r in result])
+
+
+class PatternHandlerCombinedEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        self.ph.combined_engine = True
+
+    def _add(self, *expressions):
+        for expression in expressions:
+            main_id = self.ph.add_pattern()
+            self.ph.modify_pattern(main_id, expression)
+
+    def _assert_same_as_per_pattern_execution(self, contents):
+        for content in contents:
+            self.ph.combined_engine = True
+            result = self.ph.execute(content)
+            self.ph.combined_engine = False
+            expected = self.ph.execute(content)
+            self.assertEqual(result, expected)
+            self.assertEqual(list(result.keys()), list(expected.keys()))
+
+    def test__execute_with_two_patterns(self):
+        self._add('.*(foo).*', '\s(is)\s(.*)')
+        expected = {
+            'A': {'match': 'This is foo..', 'span': (0, 13)},
+            'A1': {'match': 'foo', 'span': (8, 11)},
+            'B': {'match': ' is foo..', 'span': (4, 13)},
+            'B1': {'match': 'is', 'span': (5, 7)},
+            'B2': {'match': 'foo..', 'span': (8, 13)}
+        }
+        result = self.ph.execute('This is foo..')
+        self.assertEqual(result, expected)
+
+    def test__no_match_returns_empty_dict(self):
+        self._add('foo', 'bar(\d)')
+        self.assertEqual({}, self.ph.execute('nothing here'))
+
+    def test__results_are_the_same_as_per_pattern_execution(self):
+        self._add('(a)(b*)c', 'b+', '^x', 'c$', '(?<=a)b', r'(\w)\1', '(?P<n>\d+)',
+                  '(?P<n>[a-z]+)=', r'\bword\b', '(?i)CASE', 'a|b', '')
+        self._assert_same_as_per_pattern_execution([
+            '', 'abc', 'ac', 'xabbc', 'xx', 'ab', 'key=12 word', 'CaSe abc',
+            'zz', 'a word', '12', 'bbb', 'c'
+        ])
+
+    def test__patterns_with_flags_are_executed_on_their_own(self):
+        self._add('foo')
+        main_id = self.ph.add_pattern()
+        self.ph.modify_pattern(main_id, 'bar', re.IGNORECASE)
+        self._assert_same_as_per_pattern_execution(['foo BAR', 'bar', 'x'])
+        self.assertEqual(['B'], [single[1] for single in self.ph._get_engine().singles])
+
+    def test__global_flags_inside_the_expression_are_not_embedded(self):
+        for expression in ['foo(?i)', 'a|(?s)b', b'x(?i)y']:
+            self.assertTrue(_CombinedEngine._is_unsafe(expression), expression)
+        for expression in ['(?i:foo)', '(?-i:x)y', r'\(?i\)', '(?:a)(?=b)']:
+            self.assertFalse(_CombinedEngine._is_unsafe(expression), expression)
+        self._add('foo')
+        try:
+            # global flags out of the start are an error since Python 3.11
+            self._add('ba(?i)r')
+        except SyntaxError:
+            return
+        self._assert_same_as_per_pattern_execution(['FOO BAR', 'foo BAR', 'foo'])
+        self.assertEqual(['B'], [single[1] for single in self.ph._get_engine().singles])
+
+    def test__engine_is_rebuilt_after_modification(self):
+        self._add('foo')
+        self.assertEqual({'A': {'match': 'foo', 'span': (0, 3)}}, self.ph.execute('foo'))
+        self.ph.modify_pattern('A', 'bar')
+        self.assertEqual({}, self.ph.execute('foo'))
+        self._add('fo')
+        self.assertEqual({'B': {'match': 'fo', 'span': (0, 2)}}, self.ph.execute('foo'))
+        self.ph.remove_pattern('A')
+        self.assertEqual({'B': {'match': 'fo', 'span': (0, 2)}}, self.ph.execute('foo'))
+
+    def test__empty_pattern_raises_error(self):
+        self.ph.add_pattern()
+        with self.assertRaises(ValueError):
+            self.ph.execute('foo')
+
+
+class PatternHandlerMatchTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        main_id = self.ph.add_pattern()
+        self.ph.modify_pattern(main_id, '.*(foo).*')
+        main_id = self.ph.add_pattern()
+        self.ph.modify_pattern(main_id, '\s(is)\s(.*)')
+
+    def test__empty_pattern_list_raises_error_on_match(self):
+        with self.assertRaises(NoPatternError):
+            PatternHandler().match('foo')
+
+    def test__match_is_keyed_with_the_main_ids(self):
+        result = self.ph.match('..foo..')
+        self.assertEqual(['A'], list(result.keys()))
+        self.assertEqual(('..foo..', 'foo'), result['A'].results)
+
+    def test__combined_engine_produces_the_same_match_results(self):
+        expected = self.ph.match('This is foo..')
+        self.ph.combined_engine = True
+        result = self.ph.match('This is foo..')
+        self.assertEqual(sorted(expected.keys()), sorted(result.keys()))
+        for main_id in expected:
+            self.assertEqual(expected[main_id].results, result[main_id].results)
+            self.assertEqual(expected[main_id].spans, result[main_id].spans)
+
+    def test__lazy_scan_yields_match_results(self):
+        result = list(self.ph.scan(io.BytesIO(b'x\nThis is foo..\n'), lazy=True))
+        self.assertEqual({}, result[0][2])
+        self.assertEqual('foo..', result[1][2]['B'].group(2))
+
+
+class PatternHandlerAllOccurrencesTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        main_id = self.ph.add_pattern()
+        self.ph.modify_pattern(main_id, 'x')
+        main_id = self.ph.add_pattern()
+        self.ph.modify_pattern(main_id, '(\d)')
+
+    def test__iterate_occurrences_for_id(self):
+        result = [r.span(1) for r in self.ph.iter_matches('B', 'a1b2x3')]
+        self.assertEqual([(1, 2), (3, 4), (5, 6)], result)
+
+    def test__count_occurrences_for_id(self):
+        self.assertEqual(1, self.ph.count('A', 'a1b2x3'))
+        self.assertEqual(3, self.ph.count('B1', 'a1b2x3'))
+
+    def test__invalid_id_raises_error(self):
+        with self.assertRaises(InvalidPatternIdError):
+            self.ph.count('C', 'a1b2x3')
+        with self.assertRaises(InvalidPatternIdError):
+            self.ph.iter_matches('C', 'a1b2x3')
+
+
+class PatternHandlerPrefilterStatsTests(unittest.TestCase):
+    def test__prefilter_stats_for_every_pattern(self):
+        ph = PatternHandler()
+        ph.modify_pattern(ph.add_pattern(), 'ERROR (\d+)')
+        ph.modify_pattern(ph.add_pattern(), '\d+')
+        ph.execute('INFO 1')
+        ph.execute('ERROR 2')
+        expected = {
+            'A': {'literals': ('ERROR ',), 'hits': 1, 'misses': 1},
+            'B': {'literals': (), 'hits': 0, 'misses': 0}
+        }
+        self.assertEqual(expected, ph.get_prefilter_stats())
+
+
+class PatternHandlerBufferScanTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        self.ph.modify_pattern(self.ph.add_pattern(), b'^foo(\d+)')
+        self.ph.modify_pattern(self.ph.add_pattern(), b'bar$')
+        self.content = b'foo1 bar\r\nxfoo2\n\nfoo33\nbar'
+        self.expected = [
+            (1, 0, {'A': {'match': b'foo1', 'span': (0, 4)},
+                    'A1': {'match': b'1', 'span': (3, 4)},
+                    'B': {'match': b'bar', 'span': (5, 8)}}),
+            (2, 10, {}),
+            (3, 16, {}),
+            (4, 17, {'A': {'match': b'foo33', 'span': (0, 5)},
+                     'A1': {'match': b'33', 'span': (3, 5)}}),
+            (5, 23, {'B': {'match': b'bar', 'span': (0, 3)}})
+        ]
+
+    def test__empty_pattern_list_raises_error(self):
+        with self.assertRaises(NoPatternError):
+            list(PatternHandler().scan_buffer(b''))
+
+    def test__scan_bytes(self):
+        self.assertEqual(self.expected, list(self.ph.scan_buffer(self.content)))
+
+    def test__scan_memoryview(self):
+        self.assertEqual(self.expected, list(self.ph.scan_buffer(memoryview(self.content))))
+        view = memoryview(b'__' + self.content)[2:]
+        self.assertEqual(self.expected, list(self.ph.scan_buffer(view)))
+
+    def test__scan_memoryview_slice_without_copy(self):
+        data = bytearray(b'foo1\n' + self.content + b'\nbar')
+        view = memoryview(data)[5:5 + len(self.content)]
+        for combined_engine in (False, True):
+            self.ph.combined_engine = combined_engine
+            self.assertEqual(self.expected, list(self.ph.scan_buffer(view)))
+            result = list(self.ph.scan_buffer(view, only_matches=True, lazy=True))
+            self.assertIs(data, result[0][2]['A'].match_object.string.obj)
+
+    def test__scan_with_combined_engine(self):
+        self.ph.combined_engine = True
+        self.assertEqual(self.expected, list(self.ph.scan_buffer(self.content)))
+
+    def test__scan_memory_mapped_file(self):
+        handle, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(self.content)
+            result = list(self.ph.scan_buffer(path, only_matches=True, lazy=True))
+        finally:
+            os.remove(path)
+        self.assertEqual([1, 4, 5], [r[0] for r in result])
+        self.assertEqual(u'33', result[1][2]['A'].text(1))
+
+    def test__memory_mapped_file_is_closed_after_the_scan(self):
+        buffers = []
+        open_buffer = rak.pattern._open_buffer
+
+        def recording_open_buffer(source):
+            buffer, should_close = open_buffer(source)
+            buffers.append(buffer)
+            return buffer, should_close
+
+        handle, path = tempfile.mkstemp()
+        rak.pattern._open_buffer = recording_open_buffer
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(self.content)
+            for combined_engine in (False, True):
+                self.ph.combined_engine = combined_engine
+                self.assertEqual(self.expected, list(self.ph.scan_buffer(path)))
+        finally:
+            rak.pattern._open_buffer = open_buffer
+            os.remove(path)
+        self.assertEqual([True, True], [buffer.closed for buffer in buffers])
+
+    def test__str_patterns_raise_error(self):
+        self.ph.modify_pattern(self.ph.add_pattern(), 'foo')
+        with self.assertRaises(ValueError):
+            list(self.ph.scan_buffer(self.content))
+
+    def test__scan_empty_file(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            self.assertEqual([], list(self.ph.scan_buffer(path)))
+        finally:
+            os.remove(path)
+
+
+class PatternHandlerParallelScanTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        self.ph.modify_pattern(self.ph.add_pattern(), 'foo(\d+)')
+        self.ph.modify_pattern(self.ph.add_pattern(), '^bar')
+        self.ph.add_pattern()
+        self.ph.remove_pattern('C')
+        lines = []
+        for i in range(200):
+            lines.append(u'line {} foo{} \xe9'.format(i, i) if i % 3 else u'bar {}'.format(i))
+        handle, self.path = tempfile.mkstemp()
+        with os.fdopen(handle, 'wb') as f:
+            f.write(u'\r\n'.join(lines).encode('utf-8'))
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test__empty_pattern_list_raises_error(self):
+        with self.assertRaises(NoPatternError):
+            list(PatternHandler().scan_parallel(self.path))
+
+    def test__snapshot_can_be_restored(self):
+        snapshot = self.ph.snapshot()
+        restored = PatternHandler.from_snapshot(snapshot)
+        self.assertEqual(snapshot, restored.snapshot())
+        self.assertEqual(('A', 'B'), restored.get_main_id_list())
+        self.assertEqual('D', restored.add_pattern())
+
+    def test__serial_fallback_is_the_same_as_scan(self):
+        expected = list(self.ph.scan(self.path))
+        for chunk_size in (1, 7, 100, 100000):
+            result = list(self.ph.scan_parallel(self.path, workers=1, chunk_size=chunk_size))
+            self.assertEqual(expected, result)
+
+    def test__serial_fallback_does_not_keep_the_handlers(self):
+        list(self.ph.scan_parallel(self.path, workers=1, chunk_size=100))
+        self.assertEqual({}, _worker_handlers)
+
+    def test__parallel_scan_is_the_same_as_scan(self):
+        expected = list(self.ph.scan(self.path, only_matches=True))
+        result = list(self.ph.scan_parallel(self.path, workers=2, chunk_size=256, only_matches=True))
+        self.assertEqual(expected, result)
+
+    def test__pool_results_are_taken_through_a_bounded_window(self):
+        class RecordingPool(object):
+            submitted = 0
+
+            def apply_async(self, function, args):
+                self.submitted += 1
+                result = function(*args)
+                return type('AsyncResult', (), {'get': lambda _: result})()
+
+        pool = RecordingPool()
+        results = _imap_bounded(pool, abs, range(-1, -101, -1), 4)
+        self.assertEqual(0, pool.submitted)
+        taken = []
+        for result in results:
+            taken.append(result)
+            self.assertLessEqual(pool.submitted, len(taken) + 3)
+        self.assertEqual(list(range(1, 101)), taken)
+        self.assertEqual(100, pool.submitted)
+
+
+class PatternHandlerGroupTableTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        self.ph.modify_pattern(self.ph.add_pattern(), '(?P<key>\w+)=(?:(\d)|x)((?P<rest>.*))')
+
+    def test__full_id_list_follows_the_real_group_count(self):
+        self.assertEqual((('A', 'A1', 'A2', 'A3', 'A4'),), self.ph.get_full_id_list())
+
+    def test__group_ids_are_validated_with_the_real_group_count(self):
+        self.assertEqual({'main': 'A', 'group': 4}, self.ph.get_parsed_id('A4'))
+        with self.assertRaises(InvalidPatternIdError):
+            self.ph.get_parsed_id('A5')
+
+    def test__group_name_can_be_translated_to_id(self):
+        self.assertEqual('A1', self.ph.get_id_for_group_name('A', 'key'))
+        self.assertEqual('A4', self.ph.get_id_for_group_name('A', 'rest'))
+        with self.assertRaises(InvalidPatternIdError):
+            self.ph.get_id_for_group_name('A', 'nope')
+
+    def test__execute_uses_the_group_table(self):
+        expected = {
+            'A': {'match': 'k=1yz', 'span': (0, 5)},
+            'A1': {'match': 'k', 'span': (0, 1)},
+            'A2': {'match': '1', 'span': (2, 3)},
+            'A3': {'match': 'yz', 'span': (3, 5)},
+            'A4': {'match': 'yz', 'span': (3, 5)}
+        }
+        self.assertEqual(expected, self.ph.execute('k=1yz'))
+
+    def test__groups_that_did_not_take_part_in_the_match_have_no_id(self):
+        for combined_engine in (False, True):
+            self.ph.combined_engine = combined_engine
+            result = self.ph.execute('k=x')
+            self.assertEqual(['A', 'A1', 'A3', 'A4'], sorted(result.keys()))
+            self.assertNotIn('A2', self.ph.execute_lazy('k=x'))
+
+
+class PatternHandlerSelectiveExecutionTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        self.ph.modify_pattern(self.ph.add_pattern(), '(foo)')
+        self.ph.modify_pattern(self.ph.add_pattern(), 'bar')
+        self.ph.modify_pattern(self.ph.add_pattern(), 'baz')
+
+    def test__main_ids_of_pattern_ids(self):
+        self.assertEqual({'A', 'C'}, self.ph.get_main_ids(['A1', 'C', 'A']))
+        with self.assertRaises(InvalidPatternIdError):
+            self.ph.get_main_ids(['D'])
+
+    def test__only_the_given_patterns_are_executed(self):
+        only = self.ph.get_main_ids(['A1', 'C'])
+        for combined_engine in (False, True):
+            self.ph.combined_engine = combined_engine
+            result = self.ph.execute('foo bar baz', only)
+            self.assertEqual(['A', 'A1', 'C'], sorted(result.keys()))
+        self.assertEqual(0, self.ph.patterns[1]['pattern'].prefilter_misses)
+
+
+class PatternHandlerLazyExecutionTests(unittest.TestCase):
+    def setUp(self):
+        self.ph = PatternHandler()
+        self.ph.modify_pattern(self.ph.add_pattern(), '(foo)(x)?')
+        self.ph.modify_pattern(self.ph.add_pattern(), 'bar')
+        self.ph.modify_pattern(self.ph.add_pattern(), 'baz')
+
+    def test__lazy_results_are_the_same_as_execute(self):
+        for content in ['foo bar', 'bar baz', 'nothing']:
+            expected = self.ph.execute(content)
+            lazy = self.ph.execute_lazy(content)
+            for raw_id in ['A', 'A1', 'A2', 'B', 'C', 'D']:
+                self.assertEqual(raw_id in expected, raw_id in lazy)
+                self.assertEqual(expected.get(raw_id), lazy.get(raw_id))
+                if raw_id in expected:
+                    self.assertEqual(expected[raw_id], lazy[raw_id])
+
+    def test__patterns_are_executed_on_first_read(self):
+        statistics = {}
+        lazy = self.ph.execute_lazy('foo bar', statistics)
+        self.assertEqual({}, statistics)
+        self.assertIn('A1', lazy)
+        self.assertIn('A', lazy)
+        self.assertNotIn('C', lazy)
+        self.assertEqual(['A', 'C'], sorted(statistics.keys()))
+        self.assertEqual([1, 1], statistics['A'][:2])
+        self.assertEqual([1, 0], statistics['C'][:2])
+
+    def test__missing_id_raises_key_error(self):
+        lazy = self.ph.execute_lazy('bar')
+        with self.assertRaises(KeyError):
+            lazy['A']
+
+    def test__revision_follows_the_modifications(self):
+        revision = self.ph.revision
+        self.ph.modify_pattern('B', 'qux')
+        self.assertEqual(revision + 1, self.ph.revision)
+        self.ph.remove_pattern('C')
+        self.assertEqual(revision + 2, self.ph.revision)
@@ -1,6 +1,10 @@
+import random
 import unittest
+from array import array
 from rak.sequence import (SequenceNode, SequenceState,
-                                Offset, OffsetMode)
+                                Offset, OffsetMode, SequenceMachine,
+                                build_line_index)
+from rak.timestamp import TimestampParser
 
 
 # SequenceNode
@@ -92,6 +96,231 @@ class SequenceProcessProtocolTests(unittest.TestCase):
 
 
 # Offset
+class SequenceMachineTests(unittest.TestCase):
+    def _build_chain(self, condition_ids, offsets):
+        nodes = []
+        for i, condition_id in enumerate(condition_ids):
+            node = SequenceNode(i + 1)
+            node.condition_id = condition_id
+            if nodes:
+                node.add_prev_sequence(nodes[-1])
+                node.offset.parse(offsets[i - 1])
+            nodes.append(node)
+        return nodes
+
+    def _run(self, machine, lines):
+        results = [dict((c, True) for c in line) for line in lines]
+        return [(m['start'], m['end']) for m in machine.run(results)]
+
+    def test__steps_are_compiled_from_the_chain(self):
+        nodes = self._build_chain([1, 2, 3], ['==1', '<5'])
+        machine = SequenceMachine(nodes[0])
+        self.assertEqual((1, 2, 3), tuple(step[0] for step in machine.steps))
+        self.assertIs(nodes[2].offset, machine.steps[2][1])
+
+    def test__machine_has_to_start_with_a_trigger(self):
+        nodes = self._build_chain([1, 2], ['==1'])
+        with self.assertRaises(ValueError):
+            SequenceMachine(nodes[1])
+
+    def test__node_without_condition_raises_error(self):
+        nodes = self._build_chain([1, 0], ['==1'])
+        with self.assertRaises(ValueError):
+            SequenceMachine(nodes[0])
+
+    def test__single_node_sequence(self):
+        nodes = self._build_chain([1], [])
+        machine = SequenceMachine(nodes[0])
+        self.assertEqual([(0, 0), (2, 2)], self._run(machine, [[1], [], [1]]))
+
+    def test__equal_offset(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['==2'])[0])
+        lines = [[1], [2], [2], [1], [], [], [2]]
+        self.assertEqual([(0, 2)], self._run(machine, lines))
+
+    def test__less_than_offset(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['<2'])[0])
+        lines = [[1], [], [2], [1], [2]]
+        self.assertEqual([(3, 4)], self._run(machine, lines))
+
+    def test__greater_than_offset(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['>1'])[0])
+        lines = [[1], [2], [], [], [2]]
+        self.assertEqual([(0, 4)], self._run(machine, lines))
+
+    def test__interval_offset(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['1<$<4'])[0])
+        lines = [[1], [2], [], [], [2], [1], [], [2]]
+        self.assertEqual([(5, 7)], self._run(machine, lines))
+
+    def test__same_line_satisfies_several_steps(self):
+        machine = SequenceMachine(self._build_chain([1, 2, 3], ['<3', '==0'])[0])
+        lines = [[1], [], [2, 3]]
+        self.assertEqual([(0, 2)], self._run(machine, lines))
+
+    def test__three_step_sequence_with_restart(self):
+        machine = SequenceMachine(self._build_chain([1, 2, 3], ['==1', '<3'])[0])
+        lines = [[1], [], [1], [2], [], [], [1], [2], [3]]
+        self.assertEqual([(6, 8)], self._run(machine, lines))
+        self.assertEqual(1, machine.matches)
+
+    def test__match_details(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['<3'])[0])
+        matches = list(machine.run([{1: True}, {2: False}, {2: True}], first_line=10))
+        self.assertEqual([{'sequence': 1, 'start': 10, 'end': 12, 'lines': (10, 12)}], matches)
+
+    def test__overlapping_sequences_are_matched(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['==2'])[0])
+        lines = [[1], [1], [2], [2, 1], [], [2]]
+        self.assertEqual([(0, 2), (1, 3), (3, 5)], self._run(machine, lines))
+
+    def test__request_response_correlation(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['>=3'])[0])
+        lines = [[1]] * 1000 + [[2]]
+        matches = self._run(machine, lines)
+        self.assertEqual(998, len(matches))
+        self.assertEqual((0, 1000), matches[0])
+        self.assertEqual((997, 1000), matches[-1])
+        self.assertEqual(2, machine.info()['waiting'])
+
+    def test__instances_out_of_their_offset_are_evicted(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['<3'])[0])
+        self._run(machine, [[1], [1], [], []])
+        self.assertEqual(1, machine.info()['evictions'])
+        self.assertEqual(1, machine.info()['waiting'])
+        self._run(machine, [[]])
+        self.assertEqual(2, machine.info()['evictions'])
+        self.assertEqual(0, machine.info()['waiting'])
+
+    def test__oldest_instances_are_dropped_over_the_limit(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['>0'])[0], max_instances=2)
+        lines = [[1], [1], [1], [1], [2]]
+        self.assertEqual([(2, 4), (3, 4)], self._run(machine, lines))
+        self.assertEqual(2, machine.info()['drops'])
+
+    def test__instance_records_are_recycled(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['==1'])[0])
+        machine.process(0, {1: True})
+        record = machine._instances[0]
+        machine.process(1, {2: True})
+        machine.process(2, {1: True})
+        self.assertIs(record, machine._instances[0])
+
+    def test__reset_drops_the_waiting_instances(self):
+        machine = SequenceMachine(self._build_chain([1, 2], ['>0'])[0])
+        self._run(machine, [[1], [1]])
+        machine.reset()
+        self.assertEqual([], self._run(machine, [[2]]))
+
+
+class SequenceSearchTests(unittest.TestCase):
+    offsets = ['0', '==2', '<3', '<=2', '>1', '>=2', '1<$<4', '1<=$<3', '1<$<=3', '0<=$<=2', '<0']
+
+    def _build_machine(self, offsets):
+        nodes = []
+        for i in range(len(offsets) + 1):
+            node = SequenceNode(i + 1)
+            node.condition_id = i + 1
+            if nodes:
+                node.add_prev_sequence(nodes[-1])
+                node.offset.parse(offsets[i - 1])
+            nodes.append(node)
+        return SequenceMachine(nodes[0], max_instances=10 ** 6)
+
+    def _random_results(self, generator, count, condition_count):
+        results = []
+        for i in range(count):
+            results.append(dict((c, generator.random() < 0.3) for c in range(1, condition_count + 1)))
+        return results
+
+    def test__line_index(self):
+        results = [{1: True, 2: False}, {2: True}, {1: True, 3: True}]
+        index = build_line_index(results, first_line=5)
+        self.assertEqual({1: array('q', [5, 7]), 2: array('q', [6]), 3: array('q', [7])}, index)
+
+    def test__line_index_of_the_given_conditions(self):
+        results = [{1: True, 2: False}, {2: True}, {1: True, 3: True}]
+        index = build_line_index(results, [2, 4])
+        self.assertEqual({2: array('q', [1]), 4: array('q')}, index)
+
+    def test__search_is_the_same_as_run(self):
+        generator = random.Random(23)
+        for offset in self.offsets:
+            for offsets in ([offset], [offset, generator.choice(self.offsets)]):
+                results = self._random_results(generator, 200, len(offsets) + 1)
+                machine = self._build_machine(offsets)
+                expected = list(machine.run(results))
+                self.assertEqual(expected, machine.search(build_line_index(results)), offsets)
+
+    def test__search_with_rare_triggers(self):
+        machine = self._build_machine(['>=100', '<5'])
+        index = {1: array('q', [10, 5000]), 2: array('q', range(0, 10 ** 6, 7)),
+                 3: array('q', [113, 5200])}
+        expected = [{'sequence': 1, 'start': 10, 'end': 113, 'lines': (10, 112, 113)}]
+        self.assertEqual(expected, machine.search(index))
+        self.assertEqual([], machine.search({1: index[1], 2: index[2]}))
+
+    def test__search_does_not_change_the_machine(self):
+        machine = self._build_machine(['>0'])
+        machine.search({1: array('q', [1]), 2: array('q', [2])})
+        self.assertEqual(0, machine.info()['matches'])
+
+
+class OffsetWindowTests(unittest.TestCase):
+    def setUp(self):
+        self.o = Offset()
+
+    def _window(self, raw_offset):
+        self.o.parse(raw_offset)
+        return self.o.window()
+
+    def test__windows_of_the_modes(self):
+        self.assertEqual((3, 3), self._window('3'))
+        self.assertEqual((0, 2), self._window('<3'))
+        self.assertEqual((0, 3), self._window('<=3'))
+        self.assertEqual((4, None), self._window('>3'))
+        self.assertEqual((3, None), self._window('>=3'))
+        self.assertEqual((3, 5), self._window('2<$<6'))
+        self.assertEqual((2, 5), self._window('2<=$<6'))
+        self.assertEqual((3, 6), self._window('2<$<=6'))
+        self.assertEqual((2, 6), self._window('2<=$<=6'))
+
+    def test__window_is_the_same_as_validate_on_match(self):
+        for raw_offset in SequenceSearchTests.offsets:
+            lower, upper = self._window(raw_offset)
+            for offset in range(12):
+                inside = lower <= offset and (upper is None or offset <= upper)
+                self.assertEqual(self.o.validate_on_match(offset), inside, (raw_offset, offset))
+
+    def test__invalid_interval_raises_error(self):
+        self.o.mode = OffsetMode.interval
+        self.o.target_number = 5
+        self.o.upper_target_number = 6
+        with self.assertRaises(ValueError):
+            self.o.window()
+
+    def test__window_follows_the_settings(self):
+        self.assertEqual((2, 4), self._window('1<$<5'))
+        self.assertEqual(True, self.o.validate_on_match(4))
+        self.o.upper_target_number = 4
+        self.assertEqual((2, 3), self.o.window())
+        self.assertEqual(False, self.o.validate_on_match(4))
+        self.o.mode = OffsetMode.interval_both_may_equal
+        self.assertEqual(True, self.o.validate_on_match(4))
+        self.o.target_number = 4
+        self.assertEqual(False, self.o.validate_on_match(3))
+
+    def test__invalid_interval_raises_error_on_every_check(self):
+        self.o.mode = OffsetMode.interval
+        self.o.target_number = 5
+        self.o.upper_target_number = 5
+        for i in range(2):
+            with self.assertRaises(ValueError):
+                self.o.validate_before_match(1)
+        self.o.upper_target_number = 8
+        self.assertEqual(True, self.o.validate_on_match(6))
+
+
 class OffsetValidationTests(unittest.TestCase):
     def setUp(self):
         self.o = Offset()
@@ -325,6 +554,121 @@ class OffsetIntervalCheckingTests(unittest.TestCase):
         self.assertEqual(False, self.o._validate_interval_limits())
 
 
+class TimeOffsetTests(unittest.TestCase):
+    def setUp(self):
+        self.o = Offset()
+
+    def test__units_are_parsed(self):
+        self.o.parse('<2s')
+        self.assertEqual((2, 's', OffsetMode.less_than), (self.o.target_number, self.o.unit, self.o.mode))
+        self.o.parse('  >=  5 m ')
+        self.assertEqual((5, 'm', OffsetMode.greater_then_or_equal), (self.o.target_number, self.o.unit, self.o.mode))
+        self.o.parse('3')
+        self.assertEqual(None, self.o.unit)
+
+    def test__windows_are_in_nanoseconds(self):
+        self.o.parse('<2s')
+        self.assertEqual((0, 1999999999), self.o.window())
+        self.o.parse('3h')
+        self.assertEqual((3 * 3600 * 10 ** 9, 3 * 3600 * 10 ** 9), self.o.window())
+        self.o.parse('>=5us')
+        self.assertEqual((5000, None), self.o.window())
+
+    def test__interval_units(self):
+        self.o.parse('100ms<$<2s')
+        self.assertEqual((100, 2000, 'ms'), (self.o.target_number, self.o.upper_target_number, self.o.unit))
+        self.assertEqual((100000001, 1999999999), self.o.window())
+        self.o.parse('2ms<=$<=5')
+        self.assertEqual((2000000, 5000000), self.o.window())
+
+    def test__invalid_time_interval_raises_error(self):
+        with self.assertRaises(ValueError):
+            self.o.parse('1s<$<500ms')
+        with self.assertRaises(SyntaxError):
+            self.o.parse('2x')
+
+    def test__unit_change_updates_the_window(self):
+        self.o.parse('<2')
+        self.assertEqual(True, self.o.validate_on_match(1))
+        self.o.unit = 'ms'
+        self.assertEqual(False, self.o.validate_on_match(2000000))
+        self.assertEqual(True, self.o.validate_on_match(1999999))
+
+
+class TimedSequenceMachineTests(unittest.TestCase):
+    def _build_machine(self, offset):
+        first = SequenceNode(1)
+        first.condition_id = 1
+        second = SequenceNode(2)
+        second.condition_id = 2
+        second.add_prev_sequence(first)
+        second.offset.parse(offset)
+        return SequenceMachine(first, timestamp_id='A1', timestamp_parser=TimestampParser())
+
+    def _run(self, machine, lines):
+        results = []
+        patterns = []
+        for timestamp, conditions in lines:
+            results.append(dict((c, True) for c in conditions))
+            patterns.append({'A1': {'match': timestamp}} if timestamp else {})
+        return [(m['start'], m['end']) for m in machine.run(results, pattern_results=patterns)]
+
+    def test__timestamp_is_needed_for_time_offsets(self):
+        first = SequenceNode(1)
+        first.condition_id = 1
+        second = SequenceNode(2)
+        second.condition_id = 2
+        second.add_prev_sequence(first)
+        second.offset.parse('<1s')
+        with self.assertRaises(ValueError):
+            SequenceMachine(first)
+        second.offset.parse('<1')
+        self.assertEqual(False, SequenceMachine(first).timed)
+
+    def test__time_window(self):
+        machine = self._build_machine('<1s')
+        lines = [
+            ('2024-01-01 00:00:00.000', [1]),
+            ('2024-01-01 00:00:00.300', []),
+            ('2024-01-01 00:00:00.900', [2]),
+            ('2024-01-01 00:00:05.000', [1]),
+            ('2024-01-01 00:00:06.000', [2])
+        ]
+        self.assertEqual([(0, 2)], self._run(machine, lines))
+        self.assertEqual(0, machine.info()['waiting'])
+
+    def test__lower_time_limit(self):
+        machine = self._build_machine('>=2s')
+        lines = [
+            ('2024-01-01 00:00:00.0', [1]),
+            ('2024-01-01 00:00:01.0', [2]),
+            ('2024-01-01 00:00:02.0', [2])
+        ]
+        self.assertEqual([(0, 2)], self._run(machine, lines))
+
+    def test__lines_without_timestamp_are_skipped(self):
+        machine = self._build_machine('<1s')
+        lines = [
+            (None, [1]),
+            ('2024-01-01 00:00:00.0', [1]),
+            (None, [2]),
+            ('2024-01-01 00:00:00.5', [2])
+        ]
+        self.assertEqual([(1, 3)], self._run(machine, lines))
+
+    def test__timestamps_are_parsed_only_when_needed(self):
+        machine = self._build_machine('<1s')
+        lines = [('2024-01-01 00:00:00.0', [])] * 5 + [('2024-01-01 00:00:00.0', [1])]
+        self._run(machine, lines)
+        parser = machine.timestamp_parser
+        self.assertEqual(1, parser.prefix_hits + parser.prefix_misses)
+
+    def test__timed_machine_cannot_be_searched(self):
+        machine = self._build_machine('<1s')
+        with self.assertRaises(ValueError):
+            machine.search(build_line_index([{1: True}]))
+
+
 class OffsetParsingTests(unittest.TestCase):
     def setUp(self):
         self.o = Offset()
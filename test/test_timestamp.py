@@ -0,0 +1,64 @@
+import calendar
+import unittest
+from rak.timestamp import TimestampParser
+
+
+class TimestampParserTests(unittest.TestCase):
+    def setUp(self):
+        self.parser = TimestampParser()
+
+    def test__timestamp_is_parsed_into_epoch_nanoseconds(self):
+        expected = calendar.timegm((2024, 3, 5, 10, 20, 30, 0, 0, 0)) * 10 ** 9 + 500000000
+        self.assertEqual(expected, self.parser.parse('2024-03-05 10:20:30.5'))
+
+    def test__fraction_digits_are_scaled(self):
+        base = calendar.timegm((2024, 3, 5, 10, 20, 30, 0, 0, 0)) * 10 ** 9
+        self.assertEqual(base + 123000000, self.parser.parse('2024-03-05 10:20:30.123'))
+        self.assertEqual(base + 123456, self.parser.parse('2024-03-05 10:20:30.000123456'))
+
+    def test__rest_of_the_line_is_ignored(self):
+        self.assertEqual(self.parser.parse('2024-03-05 10:20:30.5'),
+                         self.parser.parse('2024-03-05 10:20:30.5 ERROR something'))
+
+    def test__same_second_reuses_the_prefix(self):
+        first = self.parser.parse('2024-03-05 10:20:30.100')
+        second = self.parser.parse('2024-03-05 10:20:30.250')
+        self.assertEqual(150000000, second - first)
+        self.parser.parse('2024-03-05 10:20:31.000')
+        self.assertEqual((1, 2), (self.parser.prefix_hits, self.parser.prefix_misses))
+
+    def test__month_names(self):
+        parser = TimestampParser('%d/%b/%Y:%H:%M:%S')
+        expected = calendar.timegm((2023, 12, 31, 23, 59, 59, 0, 0, 0)) * 10 ** 9
+        self.assertEqual(expected, parser.parse('31/Dec/2023:23:59:59 +0000'))
+        self.assertEqual(expected, parser.parse('31/Dec/2023:23:59:59 +0000'))
+        self.assertEqual(1, parser.prefix_hits)
+
+    def test__variable_width_format(self):
+        parser = TimestampParser('%Y-%m-%dT%H:%M:%S.%f')
+        first = parser.parse('2024-01-01T00:00:00.5')
+        second = parser.parse('2024-01-01T00:00:00.75')
+        self.assertEqual(250000000, second - first)
+        self.assertEqual(1, parser.prefix_hits)
+
+    def test__date_only_format(self):
+        parser = TimestampParser('%Y%m%d')
+        self.assertEqual(86400 * 10 ** 9, parser.parse('19700102') - parser.parse('19700101'))
+
+    def test__parsers_share_the_compiled_format(self):
+        self.assertIs(self.parser._regex, TimestampParser()._regex)
+
+    def test__invalid_timestamp_raises_error(self):
+        with self.assertRaises(ValueError):
+            self.parser.parse('not a timestamp')
+        self.parser.parse('2024-03-05 10:20:30.5')
+        with self.assertRaises(ValueError):
+            self.parser.parse('2024-03-05 10:20:30.x')
+
+    def test__unsupported_format_raises_error(self):
+        with self.assertRaises(ValueError):
+            TimestampParser('%Y-%m-%d %Z')
+        with self.assertRaises(ValueError):
+            TimestampParser('%H:%M:%S')
+        with self.assertRaises(ValueError):
+            TimestampParser('%Y-%m-%d %Y')